@@ -0,0 +1,74 @@
+import random
+import itertools
+from bisect import bisect
+from functools import lru_cache
+
+
+def _round_odds(att_n, def_n):
+    # Enumerate every roll of att_n attacking and def_n defending dice
+    counts = {}
+    for rolls in itertools.product(range(1, 7), repeat=att_n + def_n):
+        att_rolls = sorted(rolls[:att_n], reverse=True)
+        def_rolls = sorted(rolls[att_n:], reverse=True)
+        att_loss, def_loss = 0, 0
+        for i in range(min(att_n, def_n)):
+            if att_rolls[i] > def_rolls[i]:
+                def_loss += 1
+            else:
+                att_loss += 1
+        counts[(att_loss, def_loss)] = counts.get((att_loss, def_loss), 0) + 1
+    total = 6 ** (att_n + def_n)
+    return tuple((att_loss, def_loss, n / total) for (att_loss, def_loss), n in sorted(counts.items()))
+
+
+# (att_loss, def_loss, probability) for a single round, keyed by number of dice thrown
+ROUND_ODDS = {(a, d): _round_odds(a, d) for a in range(1, 4) for d in range(1, 3)}
+
+
+def round_odds(attackers, defenders):
+    return ROUND_ODDS[(min(3, attackers - 1), min(2, defenders))]
+
+
+# Exact distribution of the final (attackers, defenders) of a battle fought round by round while
+# attackers >= att_until and defenders > 0, as (outcomes, cumulative probabilities)
+@lru_cache(maxsize=4096)
+def outcome_distribution(attackers, defenders, att_until):
+    att_until = max(att_until, 2)
+    mass = {(attackers, defenders): 1.0}
+    outcomes = {}
+    # Every round removes at least one troop, so states can be processed by decreasing troop total
+    for total in range(attackers + defenders, -1, -1):
+        for f1 in range(min(attackers, total), max(total - defenders, 0) - 1, -1):
+            p = mass.pop((f1, total - f1), None)
+            if p is None:
+                continue
+            f2 = total - f1
+            if f1 < att_until or f2 == 0:
+                outcomes[(f1, f2)] = p
+                continue
+            for att_loss, def_loss, q in round_odds(f1, f2):
+                state = (f1 - att_loss, f2 - def_loss)
+                mass[state] = mass.get(state, 0.0) + p * q
+
+    states = sorted(outcomes)
+    cumulative = list(itertools.accumulate(outcomes[s] for s in states))
+    return tuple(states), tuple(cumulative)
+
+
+# Larger battles are fought round by round until they are small enough for a cached table
+MAX_TABLE_STATES = 10000
+
+
+def resolve_battle(attackers, defenders, att_until, rng=random):
+    att_until = max(att_until, 2)
+    while attackers * defenders > MAX_TABLE_STATES and attackers >= att_until:
+        r = rng.random()
+        for att_loss, def_loss, p in round_odds(attackers, defenders):
+            r -= p
+            if r < 0:
+                break
+        attackers -= att_loss
+        defenders -= def_loss
+    states, cumulative = outcome_distribution(attackers, defenders, att_until)
+    i = bisect(cumulative, rng.random() * cumulative[-1])
+    return states[min(i, len(states) - 1)]
@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+os.chdir(ROOT_PATH)
+
+import main
+import players
+from replay import ReplayWriter
+from game_state import MapIndex
+from maps.compile_map import load_compiled_map
+from maps.classic import nations, continent_bonuses
+
+# Micro and macro benchmarks of the simulator. Every benchmark reports the best time per call over
+# a few repeats; results are written as JSON and can be compared against a stored baseline, e.g.
+#   python benchmarks/hot_paths.py --save benchmarks/baseline.json
+#   python benchmarks/hot_paths.py --compare benchmarks/baseline.json
+SEED = 0
+MID_GAME_PLY = 40
+# Whole games of Player2s finish in well under a second; Player6's cost is covered by turn_Player6
+LINEUP = ["Player2", "Player2", "Player2", "Player2"]
+GAMES = 10
+
+
+def measure(function, number, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - t0) / number)
+    return best
+
+
+def mid_game(ply=MID_GAME_PLY, seed=SEED):
+    # The position after ply plies of a seeded game between Player2s; the same for every run. A
+    # game won before then is replaced by the game of the next seed.
+    for seed in range(seed, seed + 100):
+        game = main.Game(map_info=main.map_info, players=[players.Player2(n) for n in nations], seed=seed)
+        while game.ply < ply and not game.win_condition():
+            for player in game.players.values():
+                if player.is_alive and game.ply < ply and not game.win_condition():
+                    player.play_turn(game)
+                    game.draw_card(player)
+                    game.ply += 1
+            game.round_num += 1
+        if not game.win_condition():
+            return game
+    raise ValueError(f"No game reaches ply {ply}")
+
+
+def bench_battle(game, attackers, defenders):
+    # Resolves one battle from a border territory, restoring the position afterwards
+    source = next(iter(game.get_in_border("A")))
+    target = game.get_in_border("A")[source][0]
+
+    def battle():
+        checkpoint = game.checkpoint()
+        game.set_troops(source, attackers)
+        game.set_troops(target, defenders)
+        game.battle(source, target, 1, 0.5, 1)
+        game.rollback(checkpoint)
+    return battle
+
+
+def bench_turn(game, player_class):
+    # One full turn of player_class in place of A, on a fresh fork of the position
+    def turn():
+        fork = game.fork()
+        player = getattr(players, player_class)("A")
+        player.rng = random.Random(SEED)
+        fork.players["A"] = player
+        player.play_turn(fork)
+    return turn
+
+
+def bench_games(num_games):
+    # Seconds per ply over whole games of LINEUP; per ply, as game lengths vary a lot
+    seconds, plies = 0, 0
+    for seed in range(num_games):
+        lineup = [getattr(players, c)(n) for c, n in zip(LINEUP, nations)]
+        game = main.Game(map_info=main.map_info, players=lineup, seed=seed)
+        t0 = time.perf_counter()
+        main.run(game, False)
+        seconds += time.perf_counter() - t0
+        plies += game.ply
+    return seconds / plies
+
+
+def bench_map_load():
+    data = load_compiled_map(f"{ROOT_PATH}/maps/standard_map_data.xlsx", f"{ROOT_PATH}/maps/classic.json")
+    MapIndex.from_compiled(data, nations, continent_bonuses)
+
+
+def bench_snapshot_export(game, num_frames):
+    path = os.path.join(tempfile.gettempdir(), "benchmark_replay.rsk")
+
+    def export():
+        writer = ReplayWriter(path, game.map, game.map_module)
+        troops = list(game.state.troops)
+        for ply in range(num_frames):
+            troops[ply % len(troops)] += 1
+            writer.write(ply, game.state.owners, troops)
+        writer.close()
+    return export
+
+
+def run_benchmarks():
+    game = mid_game()
+    owned = list(game.get_territories("A"))
+    results = {}
+
+    def record(name, function, number, repeat=5):
+        results[name] = measure(function, number, repeat)
+        logging.info(f"{name:<24} {results[name]*1e6:12.1f} us")
+
+    record("dice_battle", lambda: main.dice_battle(3, 2), 20000)
+    for attackers, defenders in [(4, 2), (20, 10), (100, 60), (500, 300)]:
+        record(f"battle_{attackers}v{defenders}", bench_battle(game, attackers, defenders), 500)
+    record("get_out_border", lambda: game.get_out_border("A"), 5000)
+    record("get_in_border", lambda: game.get_in_border("A"), 5000)
+    record("has_path", lambda: game.has_path(owned[0], owned[-1]), 20000)
+    record("get_deploy_num", lambda: game.get_deploy_num("A"), 20000)
+    for player_class in ["Player2", "Player3", "Player6"]:
+        record(f"turn_{player_class}", bench_turn(game, player_class), 5 if player_class == "Player6" else 200)
+    results["game_ply"] = bench_games(GAMES)
+    logging.info(f"{'game_ply':<24} {results['game_ply']*1e6:12.1f} us")
+    record("map_load", bench_map_load, 20)
+    record("snapshot_export_500", bench_snapshot_export(game, 500), 5)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    # Benchmarks more than tolerance (a fraction) slower than the baseline
+    regressions = []
+    for name, seconds in results.items():
+        if name in baseline and seconds > baseline[name] * (1 + tolerance):
+            regressions.append((name, baseline[name], seconds))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the simulator's hot paths.")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before flagging, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    logging.getLogger().handlers = [logging.StreamHandler(sys.stdout)]
+    logging.getLogger().setLevel(logging.INFO)
+    results = run_benchmarks()
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            logging.info(f"REGRESSION {name}: {before*1e6:.1f} us -> {after*1e6:.1f} us ({after/before-1:+.0%})")
+        if regressions:
+            sys.exit(1)
+        logging.info("No regressions")
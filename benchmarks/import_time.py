@@ -0,0 +1,37 @@
+import os
+import sys
+import json
+import subprocess
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules to import in a fresh interpreter, from the simulation core to the rendering stack
+TARGETS = ["battle", "players", "maps.classic", "main", "game_render"]
+HEAVY = ["numpy", "pandas", "networkx", "matplotlib"]
+REPEAT = 5
+
+PROBE = """
+import sys, time, json
+t0 = time.perf_counter()
+import {module}
+t = time.perf_counter() - t0
+print(json.dumps({{"seconds": t, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module):
+    results = []
+    for _ in range(REPEAT):
+        out = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", PROBE.format(module=module, heavy=HEAVY)],
+            cwd=ROOT_PATH, capture_output=True, text=True, check=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return min(r["seconds"] for r in results), results[0]["heavy"]
+
+
+if __name__ == "__main__":
+    print("module,ms,heavy_imports")
+    for module in TARGETS:
+        seconds, heavy = time_import(module)
+        print(f"{module},{seconds*1000:.1f},{' '.join(heavy)}")
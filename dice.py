@@ -0,0 +1,40 @@
+import numpy as np
+
+
+def dice_battles(att_n, def_n, rng):
+    # One round of dice for every pair in the (att_n, def_n) arrays of dice counts
+    att_n = np.asarray(att_n)
+    def_n = np.asarray(def_n)
+    size = np.broadcast(att_n, def_n).shape
+    att_rolls = rng.integers(1, 7, size=size + (3,))
+    def_rolls = rng.integers(1, 7, size=size + (2,))
+    # Blank out unused dice so they sort last, then compare the highest pairs
+    att_rolls[np.broadcast_to(np.arange(3) >= att_n[..., None], att_rolls.shape)] = 0
+    def_rolls[np.broadcast_to(np.arange(2) >= def_n[..., None], def_rolls.shape)] = 0
+    att_rolls = -np.sort(-att_rolls, axis=-1)[..., :2]
+    def_rolls = -np.sort(-def_rolls, axis=-1)
+
+    compared = np.minimum(att_n, def_n)
+    att_wins = (att_rolls > def_rolls) & (np.arange(2) < compared[..., None])
+    def_loss = att_wins.sum(axis=-1)
+    att_loss = compared - def_loss
+    return att_loss, def_loss
+
+
+def stack_battles(attackers, defenders, att_until, rng):
+    # Fight all engagements in lockstep while attackers >= att_until and defenders > 0
+    attackers, defenders = np.broadcast_arrays(
+        np.asarray(attackers, dtype=np.int64), np.asarray(defenders, dtype=np.int64)
+    )
+    shape = attackers.shape
+    attackers, defenders = attackers.flatten(), defenders.flatten()
+    att_until = max(att_until, 2)
+    active = np.flatnonzero((attackers >= att_until) & (defenders > 0))
+    while active.size:
+        f1, f2 = attackers[active], defenders[active]
+        att_loss, def_loss = dice_battles(np.minimum(3, f1 - 1), np.minimum(2, f2), rng)
+        f1 -= att_loss
+        f2 -= def_loss
+        attackers[active], defenders[active] = f1, f2
+        active = active[(f1 >= att_until) & (f2 > 0)]
+    return attackers.reshape(shape), defenders.reshape(shape)
@@ -0,0 +1,137 @@
+import logging
+
+# Game events are plain tuples (kind, *fields) of territory and nation ids and numbers, so emitting
+# one is cheap; they are only turned into text by a sink that asks for it.
+#   ROUND       round_num
+#   STATE       owners, troops, cards per nation        (a copy of the board, only built if enabled)
+#   TURN        nation, ply
+#   INCOME      nation, troops, territories
+#   CARDS       nation, troops
+#   DEPLOY      nation, territory, troops
+#   ATTACK      source, target, defender, attackers, defenders, attacker change, defender change
+#   CONQUER     nation, territory, previous nation
+#   ELIMINATE   nation
+#   FORTIFY     source, target, troops
+#   SEARCH      nation, paths found, ms
+#   CHOICE      nation, score, territories of the chosen path, ms
+#   WIN         nation
+#   OVERRUN     nation, ply, ms taken, ms of turn budget
+ROUND, STATE, TURN, INCOME, CARDS, DEPLOY, ATTACK, CONQUER, ELIMINATE, FORTIFY, SEARCH, CHOICE, WIN, OVERRUN = range(14)
+
+
+class NullSink:
+    # Drops every event; the default, so batch games pay nothing for the event log
+    enabled = False
+
+    def emit(self, *event):
+        pass
+
+
+class ListSink:
+    # Keeps the raw event tuples, e.g. for analysis or to format them later with format_event
+    enabled = True
+
+    def __init__(self):
+        self.events = []
+
+    def emit(self, *event):
+        self.events.append(event)
+
+
+class LoggingSink:
+    # Formats every event as the text of the classic game.log and passes it to logging
+    enabled = True
+
+    def __init__(self, map_index, level=logging.DEBUG):
+        self.map = map_index
+        self.level = level
+
+    def emit(self, *event):
+        logging.log(self.level, format_event(self.map, event))
+
+
+class TextSink:
+    # Writes the game.log text to a file of its own, without going through logging
+    enabled = True
+
+    def __init__(self, map_index, path):
+        self.map = map_index
+        self.file = open(path, "w")
+
+    def emit(self, *event):
+        self.file.write(format_event(self.map, event) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class HistorySink:
+    # Keeps the territories and troops of every nation at the start of each round and the order in
+    # which nations are eliminated; cheap enough for batch games, as it never copies the board
+    enabled = False
+
+    def __init__(self, game):
+        self.game = game
+        self.rounds = []  # (round_num, territories per nation, troops per nation)
+        self.eliminations = []  # (nation, ply)
+
+    def emit(self, *event):
+        if event[0] == ROUND:
+            self.snapshot(event[1])
+        elif event[0] == ELIMINATE:
+            self.eliminations.append((event[1], self.game.ply))
+
+    def snapshot(self, round_num):
+        game = self.game
+        territories = [len(game.get_territories(n)) for n in game.nations]
+        self.rounds.append((round_num, territories, list(game.state.nation_troops)))
+
+
+NULL_SINK = NullSink()
+
+
+def format_event(map_index, event):
+    kind = event[0]
+    territories, nations = map_index.territories, map_index.nations
+    if kind == ROUND:
+        return f"==========\nRound {event[1]}"
+    if kind == STATE:
+        owners, troops, cards = event[1:]
+        output = ""
+        for k, nation in enumerate(nations):
+            owned = [i for i in range(len(owners)) if owners[i] == k]
+            output += "----------\n"
+            output += f"{nation}: {len(owned)}, {sum(troops[i] for i in owned)}, {cards[k]}\n"
+            for i in owned:
+                output += f"   {territories[i]}: {troops[i]}\n"
+        return output
+    if kind == TURN:
+        return f"{nations[event[1]]} starting turn. Ply {event[2]}"
+    if kind == INCOME:
+        return f"{nations[event[1]]} gets {event[2]} troops from {event[3]} territories."
+    if kind == CARDS:
+        return f"{nations[event[1]]} traded cards for {event[2]} troops."
+    if kind == DEPLOY:
+        return f"{nations[event[1]]} deploys {event[3]} on {territories[event[2]]}"
+    if kind == ATTACK:
+        source, target, defender, attackers, defenders, att_change, def_change = event[1:]
+        return (
+            f"{territories[source]} ({attackers}) attacks {territories[target]} ({defenders}) "
+            f"of {nations[defender]}: ({att_change}, {def_change})."
+        )
+    if kind == CONQUER:
+        return f"{nations[event[1]]} takes {territories[event[2]]} from {nations[event[3]]}!"
+    if kind == ELIMINATE:
+        return f"{nations[event[1]]} has been defeated!"
+    if kind == FORTIFY:
+        return f"Fortified {event[3]} troops from {territories[event[1]]} to {territories[event[2]]}."
+    if kind == SEARCH:
+        return f"Found {event[2]} paths in {event[3]:.0f} ms"
+    if kind == CHOICE:
+        path = [territories[i] for i in event[3]]
+        return f"Found best path, score: {event[2]} in {event[4]:.0f} ms\nBest path: {path}"
+    if kind == WIN:
+        return f"{nations[event[1]]} wins!"
+    if kind == OVERRUN:
+        return f"{nations[event[1]]} went over the turn budget at ply {event[2]}: {event[3]:.0f} of {event[4]:.0f} ms"
+    raise ValueError(f"Unknown event {event}")
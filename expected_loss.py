@@ -1,27 +1,22 @@
-from main import dice_battle
+import numpy as np
 
-n_trials = 1000000
+from dice import stack_battles
+from loss_tables import expected_loss
+
+n_trials = 100000
 
 att_strength = 100000
 
+rng = np.random.default_rng(0)
 
-def stack_battle(att_strength, def_strenth):
-    total_att_loss, total_def_loss = 0, 0
-    while att_strength >= 4 and def_strenth > 0:
-        att_loss, def_loss = dice_battle(min(3, att_strength - 1), min(2, def_strenth))
-        att_strength -= att_loss
-        def_strenth -= def_loss
-        total_att_loss += att_loss
-        total_def_loss += def_loss
-    return total_att_loss, total_def_loss
 
+def stack_battle(att_strength, def_strenth, n):
+    att_left, def_left = stack_battles(np.full(n, att_strength), np.full(n, def_strenth), 4, rng)
+    return att_strength - att_left, def_strenth - def_left
 
-print(f"def_strength,exp_loss")
-for def_strength in range(1, 20):
-    total_loss = 0
-    for _ in range(n_trials):
-        att_loss, def_loss = stack_battle(att_strength, def_strength)
-        total_loss += att_loss
-    expected_loss = total_loss / n_trials
-    print(f"{def_strength},{expected_loss:.3f}")
 
+# Exact expected loss, with a Monte Carlo estimate alongside as a sanity check
+print(f"def_strength,exp_loss,mc_loss")
+for def_strength in range(1, 20):
+    att_loss, def_loss = stack_battle(att_strength, def_strength, n_trials)
+    print(f"{def_strength},{expected_loss(def_strength):.3f},{att_loss.mean():.3f}")
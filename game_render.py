@@ -1,13 +1,84 @@
 import os
+import argparse
 import _pickle as pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
+from replay import ReplayReader
+
 folder = r"past_games/20200427_144916_game"
 
 
-def render(folder):
+def _render_frames(replay_path, start, stop, folder):
+    # Renders frames start..stop-1 of a replay with one figure that is updated in place
+    replay = ReplayReader(replay_path)
+    renderer = replay.frame_renderer()
+    for i, (ply, owners, troops) in enumerate(replay.frames(start, stop), start):
+        renderer.draw(i, owners, troops)
+        renderer.save(os.path.join(folder, f"{i}.png"))
+    renderer.close()
+    replay.close()
+    return stop - start
+
+
+def _missing_ranges(folder, num_frames, chunk_size):
+    # Runs of consecutive frames that are not on disk yet, split into chunks of at most chunk_size
+    ranges = []
+    start = None
+    for i in range(num_frames + 1):
+        missing = i < num_frames and not os.path.exists(os.path.join(folder, f"{i}.png"))
+        if missing and start is None:
+            start = i
+        if start is not None and (not missing or i - start == chunk_size):
+            ranges.append((start, i))
+            start = i if missing else None
+    return ranges
+
+
+def render_replay(replay_path, folder, workers=None, chunk_size=50):
+    # Writes one png per frame, spread over a process pool; frames already rendered are skipped
+    replay = ReplayReader(replay_path)
+    num_frames = len(replay)
+    replay.close()
+    ranges = _missing_ranges(folder, num_frames, chunk_size)
+    if workers == 1:
+        return sum(_render_frames(replay_path, start, stop, folder) for start, stop in ranges)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_frames, replay_path, start, stop, folder) for start, stop in ranges]
+        return sum(future.result() for future in futures)
+
+
+def animate_replay(replay_path, output, fps=4):
+    # Writes the whole replay as one animation; gif through pillow, anything else (mp4) through ffmpeg
+    from matplotlib.animation import FuncAnimation
+
+    replay = ReplayReader(replay_path)
+    renderer = replay.frame_renderer()
+    frames = enumerate(replay)
+    animation = FuncAnimation(
+        renderer.fig,
+        lambda frame: renderer.draw(frame[0], *frame[1][1:]),
+        frames=frames,
+        save_count=len(replay),
+        blit=True,
+    )
+    animation.save(output, writer="pillow" if output.endswith(".gif") else "ffmpeg", fps=fps)
+    renderer.close()
+    replay.close()
+
+
+def render(folder, workers=None, animation=None):
     for filename in os.listdir(folder):
-        if filename.endswith(".p"):
+        if filename.endswith(".rsk"):
+            replay_path = os.path.join(folder, filename)
+            if animation is not None:
+                animate_replay(replay_path, os.path.join(folder, animation))
+            else:
+                render_replay(replay_path, folder, workers)
+        elif filename.endswith(".p"):  # games saved before replay files
             with open(os.path.join(folder, filename), "rb") as f:
                 renderer, snapshots = pickle.load(f)
 
@@ -18,4 +89,9 @@ def render(folder):
 
 
 if __name__ == "__main__":
-    render(folder)
+    parser = argparse.ArgumentParser(description="Render the snapshots of a saved game.")
+    parser.add_argument("folder", nargs="?", default=folder)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--animation", help="write a single animation (e.g. game.gif or game.mp4) instead of pngs")
+    args = parser.parse_args()
+    render(args.folder, args.workers, args.animation)
@@ -0,0 +1,247 @@
+from array import array
+
+
+class MapIndex:
+    # Static map topology with territories, nations and continents numbered 0..n-1 and adjacency in
+    # CSR form: the neighbors of territory i are adj_targets[adj_offsets[i]:adj_offsets[i + 1]]
+    __slots__ = (
+        "territories", "index", "nations", "nation_index", "continents", "continent_index",
+        "territory_continent", "continent_territories", "continent_bonuses", "coordinates",
+        "adj_offsets", "adj_targets", "neighbor_ids", "neighbor_names",
+    )
+
+    def __init__(
+        self, territories, neighbors, territory_continent, nations, continents, continent_bonuses, coordinates
+    ):
+        self.territories = tuple(territories)
+        self.index = {t: i for i, t in enumerate(self.territories)}
+        self.nations = tuple(nations)
+        self.nation_index = {n: i for i, n in enumerate(self.nations)}
+        self.continents = tuple(continents)
+        self.continent_index = {c: i for i, c in enumerate(self.continents)}
+        self.territory_continent = array("b", [self.continent_index[territory_continent[t]] for t in territories])
+        self.continent_territories = tuple(
+            tuple(self.index[t] for t in continents[c]) for c in self.continents
+        )
+        self.continent_bonuses = array("i", [continent_bonuses[c] for c in self.continents])
+        self.coordinates = tuple(coordinates[t] for t in self.territories)
+
+        self.adj_offsets = array("i", [0])
+        self.adj_targets = array("i")
+        for t in self.territories:
+            self.adj_targets.extend(self.index[n] for n in neighbors[t])
+            self.adj_offsets.append(len(self.adj_targets))
+        # Tuple views of the CSR rows, for fast iteration from Python
+        self.neighbor_ids = tuple(
+            tuple(self.adj_targets[self.adj_offsets[i]:self.adj_offsets[i + 1]])
+            for i in range(len(self.territories))
+        )
+        self.neighbor_names = tuple(
+            tuple(self.territories[j] for j in row) for row in self.neighbor_ids
+        )
+
+    @classmethod
+    def from_compiled(cls, data, nations, continent_bonuses):
+        # Builds the index from a compiled map (see maps/compile_map.py)
+        territories = data["territories"]
+        offsets, targets = data["adj_offsets"], data["adj_targets"]
+        return cls(
+            territories=territories,
+            neighbors={
+                t: [territories[j] for j in targets[offsets[i]:offsets[i + 1]]] for i, t in enumerate(territories)
+            },
+            territory_continent=dict(zip(territories, data["continent"])),
+            nations=nations,
+            continents=data["continents"],
+            continent_bonuses=continent_bonuses,
+            coordinates={t: (x, y) for t, x, y in zip(territories, data["x"], data["y"])},
+        )
+
+    def to_graph(self):
+        # networkx graph of the map for rendering, with the static node attributes set
+        import networkx as nx
+
+        g = nx.Graph()
+        for i, t in enumerate(self.territories):
+            x, y = self.coordinates[i]
+            g.add_node(t, continent=self.continents[self.territory_continent[i]], x=x, y=y)
+        for i, row in enumerate(self.neighbor_names):
+            for n in row:
+                g.add_edge(self.territories[i], n)
+        return g
+
+    def __len__(self):
+        return len(self.territories)
+
+
+class GameState:
+    # Mutable per-game state: troops and owning nation id per territory id, plus indexes derived from
+    # them that set_troops/set_owner keep up to date incrementally:
+    #   nation_adjacent[k][i]   number of neighbors of territory i owned by nation k
+    #   in_borders[k]           territories of k with an enemy neighbor
+    #   out_borders[k]          enemy territories adjacent to k
+    #   continent_counts[k][c]  territories of continent c owned by k
+    #   continent_troops[k][c]  troops of k on continent c
+    #   continent_bonus[k]      bonus of the continents wholly owned by k
+    #   nation_troops[k]        total troops of k
+    # and the connected components of every nation's territories, relabelled lazily per nation:
+    #   components[i]           id of the component of i within its owner's territories
+    #   components_dirty[k]     whether the labels of k are stale
+    __slots__ = (
+        "map", "troops", "owners", "nation_adjacent", "in_borders", "out_borders",
+        "continent_counts", "continent_troops", "continent_bonus", "nation_troops",
+        "components", "components_dirty",
+    )
+
+    def __init__(self, map_index, troops, owners):
+        self.map = map_index
+        self.troops = array("i", troops)
+        self.owners = array("b", owners)
+        self._build_indexes()
+
+    def _build_indexes(self):
+        m = self.map
+        num_nations, num_continents = len(m.nations), len(m.continents)
+        self.nation_adjacent = [array("i", [0] * len(m)) for _ in range(num_nations)]
+        self.in_borders = [set() for _ in range(num_nations)]
+        self.out_borders = [set() for _ in range(num_nations)]
+        self.continent_counts = [array("i", [0] * num_continents) for _ in range(num_nations)]
+        self.continent_troops = [array("i", [0] * num_continents) for _ in range(num_nations)]
+        self.continent_bonus = array("i", [0] * num_nations)
+        self.nation_troops = array("i", [0] * num_nations)
+        self.components = array("i", range(len(m)))
+        self.components_dirty = [True] * num_nations
+        for i, owner in enumerate(self.owners):
+            c = m.territory_continent[i]
+            self.continent_counts[owner][c] += 1
+            self.continent_troops[owner][c] += self.troops[i]
+            self.nation_troops[owner] += self.troops[i]
+            for j in m.neighbor_ids[i]:
+                self.nation_adjacent[owner][j] += 1
+        for k in range(num_nations):
+            for c, territories in enumerate(m.continent_territories):
+                if self.continent_counts[k][c] == len(territories):
+                    self.continent_bonus[k] += m.continent_bonuses[c]
+            for i in range(len(m)):
+                self._refresh_border(i, k)
+
+    def copy(self):
+        # Shares the map, copies the buffers
+        state = GameState.__new__(GameState)
+        state.map = self.map
+        state.troops = self.troops[:]
+        state.owners = self.owners[:]
+        state.nation_adjacent = [a[:] for a in self.nation_adjacent]
+        state.in_borders = [set(b) for b in self.in_borders]
+        state.out_borders = [set(b) for b in self.out_borders]
+        state.continent_counts = [a[:] for a in self.continent_counts]
+        state.continent_troops = [a[:] for a in self.continent_troops]
+        state.continent_bonus = self.continent_bonus[:]
+        state.nation_troops = self.nation_troops[:]
+        state.components = self.components[:]
+        state.components_dirty = self.components_dirty[:]
+        return state
+
+    def set_troops(self, i, troops):
+        owner = self.owners[i]
+        change = troops - self.troops[i]
+        self.troops[i] = troops
+        self.nation_troops[owner] += change
+        self.continent_troops[owner][self.map.territory_continent[i]] += change
+
+    def set_owner(self, i, owner):
+        old = self.owners[i]
+        if old == owner:
+            return
+        m = self.map
+        self.owners[i] = owner
+        self.components_dirty[old] = True
+        self.components_dirty[owner] = True
+        troops = self.troops[i]
+        self.nation_troops[old] -= troops
+        self.nation_troops[owner] += troops
+
+        c = m.territory_continent[i]
+        size = len(m.continent_territories[c])
+        if self.continent_counts[old][c] == size:
+            self.continent_bonus[old] -= m.continent_bonuses[c]
+        self.continent_counts[old][c] -= 1
+        self.continent_counts[owner][c] += 1
+        if self.continent_counts[owner][c] == size:
+            self.continent_bonus[owner] += m.continent_bonuses[c]
+        self.continent_troops[old][c] -= troops
+        self.continent_troops[owner][c] += troops
+
+        # Only the border status of i and its neighbors can change, and only for old and owner
+        old_adjacent, new_adjacent = self.nation_adjacent[old], self.nation_adjacent[owner]
+        old_in, old_out = self.in_borders[old], self.out_borders[old]
+        new_in, new_out = self.in_borders[owner], self.out_borders[owner]
+        old_in.discard(i)
+        if old_adjacent[i]:
+            old_out.add(i)
+        new_out.discard(i)
+        if new_adjacent[i] < len(m.neighbor_ids[i]):
+            new_in.add(i)
+        for j in m.neighbor_ids[i]:
+            old_adjacent[j] -= 1
+            new_adjacent[j] += 1
+            owner_j = self.owners[j]
+            if owner_j == old:
+                old_in.add(j)
+                new_out.add(j)
+            elif owner_j == owner:
+                if new_adjacent[j] == len(m.neighbor_ids[j]):
+                    new_in.discard(j)
+                if not old_adjacent[j]:
+                    old_out.discard(j)
+            else:
+                new_out.add(j)
+                if not old_adjacent[j]:
+                    old_out.discard(j)
+
+    def _refresh_border(self, i, k):
+        adjacent = self.nation_adjacent[k][i]
+        if self.owners[i] == k:
+            self.out_borders[k].discard(i)
+            if adjacent < len(self.map.neighbor_ids[i]):
+                self.in_borders[k].add(i)
+            else:
+                self.in_borders[k].discard(i)
+        else:
+            self.in_borders[k].discard(i)
+            if adjacent > 0:
+                self.out_borders[k].add(i)
+            else:
+                self.out_borders[k].discard(i)
+
+    def component(self, i):
+        k = self.owners[i]
+        if self.components_dirty[k]:
+            self._label_components(k)
+        return self.components[i]
+
+    def _label_components(self, k):
+        # Flood fill over the nation's territories; a component is labelled by its first territory
+        owners, components, neighbor_ids = self.owners, self.components, self.map.neighbor_ids
+        seen = set()
+        for i in range(len(owners)):
+            if owners[i] != k or i in seen:
+                continue
+            seen.add(i)
+            stack = [i]
+            while stack:
+                j = stack.pop()
+                components[j] = i
+                for n in neighbor_ids[j]:
+                    if owners[n] == k and n not in seen:
+                        seen.add(n)
+                        stack.append(n)
+        self.components_dirty[k] = False
+
+    def territories_of(self, nation_id):
+        return [i for i, owner in enumerate(self.owners) if owner == nation_id]
+
+    def write_to_graph(self, g):
+        for i, t in enumerate(self.map.territories):
+            g.nodes[t]["troops"] = self.troops[i]
+            g.nodes[t]["nation"] = self.map.nations[self.owners[i]]
@@ -0,0 +1,98 @@
+import os
+from collections import namedtuple
+import _pickle as pickle
+
+from battle import ROUND_ODDS, MAX_TABLE_STATES, round_odds, outcome_distribution
+from root_path import ROOT_PATH
+
+CACHE_FOLDER = f"{ROOT_PATH}/cache"
+TABLE_VERSION = 1
+MAX_ATTACKERS = 60
+MAX_DEFENDERS = 40
+
+BattleOdds = namedtuple(
+    "BattleOdds", ["attacker_loss", "defender_loss", "win_probability", "distribution"]
+)
+
+_tables = {}
+
+
+def _odds(attackers, defenders, outcomes):
+    # outcomes: {(final attackers, final defenders): probability}
+    distribution = {(attackers - f1, defenders - f2): p for (f1, f2), p in outcomes.items()}
+    return BattleOdds(
+        attacker_loss=sum(al * p for (al, _), p in distribution.items()),
+        defender_loss=sum(dl * p for (_, dl), p in distribution.items()),
+        win_probability=sum(p for (f1, f2), p in outcomes.items() if f2 == 0),
+        distribution=distribution,
+    )
+
+
+def build_table(max_attackers, max_defenders, att_until):
+    # Backward induction over battle states: the final-state distribution of (f1, f2) is the
+    # round-odds mixture of the distributions of the states it can move to, which are all smaller
+    att_until = max(att_until, 2)
+    finals = {}
+    for f1 in range(max_attackers + 1):
+        for f2 in range(max_defenders + 1):
+            if f1 < att_until or f2 == 0:
+                finals[(f1, f2)] = {(f1, f2): 1.0}
+                continue
+            outcomes = {}
+            for att_loss, def_loss, q in round_odds(f1, f2):
+                for state, p in finals[(f1 - att_loss, f2 - def_loss)].items():
+                    outcomes[state] = outcomes.get(state, 0.0) + p * q
+            finals[(f1, f2)] = outcomes
+    return {(a, d): _odds(a, d, outcomes) for (a, d), outcomes in finals.items()}
+
+
+def _cache_path(max_attackers, max_defenders, att_until):
+    return f"{CACHE_FOLDER}/loss_table_v{TABLE_VERSION}_{max_attackers}x{max_defenders}_{att_until}.p"
+
+
+def load_table(att_until, max_attackers=MAX_ATTACKERS, max_defenders=MAX_DEFENDERS):
+    key = (max_attackers, max_defenders, att_until)
+    if key in _tables:
+        return _tables[key]
+    path = _cache_path(*key)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            table = {state: BattleOdds(*odds) for state, odds in pickle.load(f).items()}
+    else:
+        table = build_table(*key)
+        os.makedirs(CACHE_FOLDER, exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump({state: tuple(odds) for state, odds in table.items()}, f)
+    _tables[key] = table
+    return table
+
+
+def battle_odds(attackers, defenders, att_until):
+    if attackers <= MAX_ATTACKERS and defenders <= MAX_DEFENDERS:
+        return load_table(att_until)[(attackers, defenders)]
+    if attackers * defenders > MAX_TABLE_STATES:
+        # Too big to keep: computed without the cache, so huge stacks can't fill it with tables
+        states, cumulative = outcome_distribution.__wrapped__(attackers, defenders, att_until)
+    else:
+        states, cumulative = outcome_distribution(attackers, defenders, att_until)
+    probabilities = [c - p for c, p in zip(cumulative, (0.0, *cumulative[:-1]))]
+    return _odds(attackers, defenders, dict(zip(states, probabilities)))
+
+
+def expected_loss(defenders):
+    # Expected attacker loss to wipe out defenders with an attacker large enough to always roll 3
+    # dice: E(d) = sum p * (att_loss + E(d - def_loss)), solved for the E(d) on the right-hand side
+    losses = [0.0]
+    for d in range(1, defenders + 1):
+        odds = ROUND_ODDS[(3, min(2, d))]
+        round_loss = sum(p * att_loss for att_loss, _, p in odds)
+        stall = sum(p for _, def_loss, p in odds if def_loss == 0)
+        progress = sum(p * losses[d - def_loss] for _, def_loss, p in odds if def_loss)
+        losses.append((round_loss + progress) / (1 - stall))
+    return losses[defenders]
+
+
+if __name__ == "__main__":
+    for att_until in (3, 4):
+        table = load_table(att_until)
+        print(f"att_until={att_until}: {len(table)} states in {_cache_path(MAX_ATTACKERS, MAX_DEFENDERS, att_until)}")
@@ -1,33 +1,32 @@
 import os
 import sys
-import networkx as nx
-import _pickle as pickle
-
-from players import *
+import copy
+import time
+import random
+import logging
+
+from players import Player, Player2, Player3, Player4, Player5, Player6
+from battle import resolve_battle
+from loss_tables import battle_odds, expected_loss
+from game_state import GameState
+from replay import ReplayWriter
+import events
 from maps.classic import map_info
-from game_render import render
 
-storage_folder = f"past_games/{time.strftime('%Y%m%d_%H%M%S')}_game"
-os.makedirs(storage_folder)
 
-logging.basicConfig(
-    format="%(message)s",
-    filename=f"{storage_folder}/game.log",
-    filemode="w",
-    level=logging.DEBUG
-)
-logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
-logging.StreamHandler().setLevel(logging.DEBUG)
-logging.getLogger('matplotlib.font_manager').disabled = True
+def new_game_folder(root="past_games"):
+    folder = f"{root}/{time.strftime('%Y%m%d_%H%M%S')}_game"
+    os.makedirs(folder, exist_ok=True)
+    return folder
 
 
-def dice_roll():
-    return random.choice(list(range(6))) + 1
+def dice_roll(rng=random):
+    return rng.choice(list(range(6))) + 1
 
 
-def dice_battle(att_n, def_n):
-    att_rolls = sorted([dice_roll() for _ in range(att_n)], reverse=True)
-    def_rolls = sorted([dice_roll() for _ in range(def_n)], reverse=True)
+def dice_battle(att_n, def_n, rng=random):
+    att_rolls = sorted([dice_roll(rng) for _ in range(att_n)], reverse=True)
+    def_rolls = sorted([dice_roll(rng) for _ in range(def_n)], reverse=True)
 
     att_loss, def_loss = 0, 0
     for i in range(min(len(att_rolls), len(def_rolls))):
@@ -39,51 +38,76 @@ def dice_battle(att_n, def_n):
     return att_loss, def_loss
 
 
-def expected_loss(defenders):
-    if defenders <= 5:
-        return {1: 0.516, 2: 1.547, 3: 2.307, 4: 3.210, 5: 4.037}[defenders]
-    else:
-        return 0.8537 * defenders + 1.4817
-
-
 class Game:
-    def __init__(self, map_info, players):
+    def __init__(self, map_info, players, event_sink=None, seed=None, turn_budget=None, node_budget=None):
         self.players = {p.nation: p for p in players}
         self.round_num = 0
         self.ply = 0
+        # Dice, cards and every player's decisions each draw from their own stream derived from the
+        # seed, so a game can be replayed exactly and one player's choices never shift the dice
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.dice_rng = random.Random(f"{self.seed}/dice")
+        self.card_rng = random.Random(f"{self.seed}/cards")
+        for p in players:
+            p.rng = random.Random(f"{self.seed}/player/{p.nation}")
         # Setup map
-        self.g = map_info["graph"]
+        self.g = None  # networkx graph for rendering, built on first use
         self.nations = map_info["nations"]
         self.continents = map_info["continent_definition"]
         self.continent_bonuses = map_info["continent_bonuses"]
         self.renderer = map_info["renderer"]
-        self.snapshots = []
-        self.nation_territories = {}
-        for t in self.g.nodes:
-            self.nation_territories.setdefault(self.g.nodes[t]["nation"], set()).add(t)
-        self.territory_ownership = {t: self.g.nodes[t]["nation"] for t in self.g.nodes}  # for speed
-        self.territory_troops = {t: self.g.nodes[t]["troops"] for t in self.g.nodes}  # for speed
-        self.territory_continent = {t: self.g.nodes[t]["continent"] for t in self.g.nodes}  # idem
+        self.map_module = map_info["module"]
+        self.replay = None  # replay file written while snapshots are on
+        self.undo_log = None
+        self.events = event_sink if event_sink is not None else events.NULL_SINK
+        # Every turn's decision should take at most turn_budget seconds and node_budget paths of
+        # search; players see the deadline, turns that take longer anyway are kept in overruns as
+        # (nation, ply, seconds). Node budgets keep games reproducible, time budgets can't.
+        self.turn_budget = turn_budget
+        self.node_budget = node_budget
+        self.overruns = []
+        self.turn_start = None
+        # Troops and owners live in the array-backed state, indexed by territory id
+        self.map = map_info["map_index"]
+        self.state = GameState(
+            self.map,
+            troops=map_info["initial_troops"],
+            owners=[self.map.nation_index[n] for n in map_info["initial_nations"]],
+        )
+        # Kept in territory id order, so iterating over a nation's territories is the same in every
+        # run and doesn't depend on the order of conquests or of what a rollback undid
+        self.nation_territories = {n: {} for n in self.nations}
+        for t in self.map.territories:
+            self.nation_territories[self.get_nation(t)][t] = None
+        self.territory_continent = {  # for speed
+            t: self.map.continents[c] for t, c in zip(self.map.territories, self.map.territory_continent)
+        }
+
+    @property
+    def territory_ownership(self):
+        return {t: self.map.nations[n] for t, n in zip(self.map.territories, self.state.owners)}
+
+    @property
+    def territory_troops(self):
+        return dict(zip(self.map.territories, self.state.troops))
 
     def get_all_territories(self):
-        return set([t for n in self.nations for t in self.nation_territories[n]])
+        return dict.fromkeys(self.map.territories)
 
     def get_territories(self, nation):
         return self.nation_territories[nation]
 
     def get_neighbors(self, territory):
-        return self.g.neighbors(territory)
+        return self.map.neighbor_names[self.map.index[territory]]
 
     def get_nation(self, territory):
-        # return self.g.nodes[territory]["nation"]
-        return self.territory_ownership[territory]
+        return self.map.nations[self.state.owners[self.map.index[territory]]]
 
     def get_player(self, territory):
         return self.players[self.get_nation(territory)]
 
     def get_troops(self, territory):
-        # return self.g.nodes[territory]["troops"]
-        return self.territory_troops[territory]
+        return self.state.troops[self.map.index[territory]]
 
     def get_continent(self, territory):
         return self.territory_continent[territory]
@@ -92,41 +116,115 @@ class Game:
         return self.continents[continent]
 
     def get_total_troops(self, nation):
-        return sum([self.get_troops(t) for t in self.get_territories(nation)])
+        return self.state.nation_troops[self.map.nation_index[nation]]
+
+    def get_continent_count(self, continent, nation):
+        return self.state.continent_counts[self.map.nation_index[nation]][self.map.continent_index[continent]]
+
+    def get_continent_troops(self, continent, nation=None):
+        c = self.map.continent_index[continent]
+        if nation is None:
+            return sum(troops[c] for troops in self.state.continent_troops)
+        return self.state.continent_troops[self.map.nation_index[nation]][c]
+
+    def get_continent_owner(self, continent):
+        c = self.map.continent_index[continent]
+        for k, counts in enumerate(self.state.continent_counts):
+            if counts[c] == len(self.map.continent_territories[c]):
+                return self.map.nations[k]
+        return None
 
     def set_troops(self, territory, troops):
-        self.g.nodes[territory]["troops"] = troops
-        self.territory_troops[territory] = troops
+        i = self.map.index[territory]
+        if self.undo_log is not None:
+            self.undo_log.append((i, self.state.owners[i], self.state.troops[i]))
+        self.state.set_troops(i, troops)
 
     def adjust_troops(self, territory, troop_adjustment):
-        self.g.nodes[territory]["troops"] += troop_adjustment
-        self.territory_troops[territory] += troop_adjustment
+        i = self.map.index[territory]
+        if self.undo_log is not None:
+            self.undo_log.append((i, self.state.owners[i], self.state.troops[i]))
+        self.state.set_troops(i, self.state.troops[i] + troop_adjustment)
 
     def set_nation(self, territory, nation):
-        original_nation = self.get_nation(territory)
-        self.g.nodes[territory]["nation"] = nation
-        self.nation_territories[original_nation].remove(territory)
-        self.nation_territories[nation].add(territory)
-        self.territory_ownership[territory] = nation
+        i = self.map.index[territory]
+        if self.undo_log is not None:
+            self.undo_log.append((i, self.state.owners[i], self.state.troops[i]))
+        self._set_owner(i, self.map.nation_index[nation])
+
+    def _set_owner(self, i, owner):
+        if self.state.owners[i] == owner:
+            return
+        territory = self.map.territories[i]
+        del self.nation_territories[self.map.nations[self.state.owners[i]]][territory]
+        owned = self.nation_territories[self.map.nations[owner]]
+        if owned and self.map.index[next(reversed(owned))] > i:
+            # Rebuilt in place rather than replaced, as callers may hold on to the dict
+            ordered = sorted([*owned, territory], key=self.map.index.__getitem__)
+            owned.clear()
+            owned.update(dict.fromkeys(ordered))
+        else:
+            owned[territory] = None
+        self.state.set_owner(i, owner)
+
+    def checkpoint(self):
+        # Start (or nest) recording changes so they can be undone with rollback
+        if self.undo_log is None:
+            self.undo_log = []
+        return len(self.undo_log)
+
+    def rollback(self, checkpoint):
+        while len(self.undo_log) > checkpoint:
+            i, owner, troops = self.undo_log.pop()
+            if self.state.owners[i] != owner:
+                self._set_owner(i, owner)
+            self.state.set_troops(i, troops)
+        if checkpoint == 0:
+            self.undo_log = None
+
+    def commit(self, checkpoint):
+        # Keep the changes made since the checkpoint
+        if checkpoint == 0:
+            self.undo_log = None
+
+    def fork(self):
+        # Independent copy of the game that shares the static map, graph and renderer
+        game = copy.copy(self)
+        game.state = self.state.copy()
+        game.nation_territories = {n: dict(ts) for n, ts in self.nation_territories.items()}
+        game.players = {n: copy.copy(p) for n, p in self.players.items()}
+        for p in game.players.values():
+            p.cards = list(p.cards)
+            p.rng = random.Random(f"{self.seed}/fork/{self.ply}/player/{p.nation}")
+        # Forks roll their own dice, they can't peek at the game's upcoming rolls
+        game.dice_rng = random.Random(f"{self.seed}/fork/{self.ply}/dice")
+        game.card_rng = random.Random(f"{self.seed}/fork/{self.ply}/cards")
+        game.replay = None
+        game.undo_log = None
+        game.overruns = []
+        game.events = events.NULL_SINK
+        game.g = None
+        return game
+
+    def sync_graph(self):
+        # The graph is only used for rendering, so it is brought up to date on demand
+        if self.g is None:
+            self.g = self.map.to_graph()
+        self.state.write_to_graph(self.g)
+
+    def get_component(self, territory):
+        # Territories of the same nation are connected through it iff their components are equal
+        return self.state.component(self.map.index[territory])
 
     def has_path(self, t1, t2):
-        try:
-            return nx.has_path(self.g.subgraph(self.get_territories(self.get_nation(t1))), t1, t2)
-        except nx.NodeNotFound:
+        i, j = self.map.index[t1], self.map.index[t2]
+        if self.state.owners[i] != self.state.owners[j]:
             return False
+        return self.state.component(i) == self.state.component(j)
 
     def get_deploy_num(self, nation):
-        territories = self.get_territories(nation)
-        # check continents
-        territories_split_by_continent = {}
-        for t in territories:
-            territories_split_by_continent.setdefault(self.get_continent(t), []).append(t)
-        continent_bonus = 0
-        for c in self.continents:
-            if len(self.continents[c]) == len(territories_split_by_continent.get(c, [])):
-                continent_bonus += self.continent_bonuses[c]
-
-        return max(len(territories) // 3, 3) + continent_bonus
+        continent_bonus = self.state.continent_bonus[self.map.nation_index[nation]]
+        return max(len(self.get_territories(nation)) // 3, 3) + continent_bonus
 
     def battle(self, t1, t2, att_until, target_leave_frac, leave_cap):
         # check different nations
@@ -142,22 +240,19 @@ class Game:
 
         fi1 = f1
         fi2 = f2
-        while f1 >= att_until and f2 > 0:
-            att_loss, def_loss = dice_battle(min(3, f1 - 1), min(2, f2))
-            f1 -= att_loss
-            f2 -= def_loss
+        f1, f2 = resolve_battle(f1, f2, att_until, self.dice_rng)
 
-        logging.debug(
-            f"{t1} ({fi1}) attacks {t2} ({fi2}) of {self.get_nation(t2)}: ({f1-fi1}, {f2-fi2})."
-        )
+        i1, i2 = self.map.index[t1], self.map.index[t2]
+        attacker, defender = self.state.owners[i1], self.state.owners[i2]
+        self.events.emit(events.ATTACK, i1, i2, defender, fi1, fi2, f1 - fi1, f2 - fi2)
 
         if f2 == 0:  # Territory has been conquered
-            logging.debug(f"{self.get_nation(t1)} takes {t2} from {self.get_nation(t2)}!")
+            self.events.emit(events.CONQUER, attacker, i2, defender)
             attacking_player = self.get_player(t1)
             attacking_player.gets_card = True
             # Check defeat
             if len(self.get_territories(self.get_nation(t2))) == 1:
-                logging.debug(f"{self.get_nation(t2)} has been defeated!")
+                self.events.emit(events.ELIMINATE, defender)
                 defeated_player = self.get_player(t2)
                 defeated_player.is_alive = False
                 # Transfer cards
@@ -172,51 +267,76 @@ class Game:
         self.set_troops(t1, f1)
         self.set_troops(t2, f2)
 
+    def get_battle_odds(self, t1, t2, att_until):
+        return battle_odds(self.get_troops(t1), self.get_troops(t2), att_until)
+
     def fortify(self, source, target, troops):
         if self.has_path(source, target) and self.get_troops(source) > troops:
             self.adjust_troops(source, -troops)
             self.adjust_troops(target, troops)
-            logging.debug(f"Fortified {troops} troops from {source} to {target}.")
+            self.events.emit(events.FORTIFY, self.map.index[source], self.map.index[target], troops)
         else:
             logging.error(f"Cannot fortify {troops} troops from {source} to {target}, no path.")
 
     def get_out_border(self, nation):
-        targets = {}
-        for t in self.get_territories(nation):
-            for tn in self.get_neighbors(t):
-                if self.get_nation(tn) == nation:
-                    continue
-                targets.setdefault(tn, []).append(t)
-        return targets
+        # Enemy territories next to nation, each with the nation's territories that border it, in
+        # territory id order so players break ties the same way in every run (and as batch.py does)
+        k = self.map.nation_index[nation]
+        owners, territories = self.state.owners, self.map.territories
+        return {
+            territories[i]: [territories[j] for j in self.map.neighbor_ids[i] if owners[j] == k]
+            for i in sorted(self.state.out_borders[k])
+        }
 
     def get_in_border(self, nation):
-        border = {}
-        for t in self.get_territories(nation):
-            for tn in self.get_neighbors(t):
-                if self.get_nation(tn) == nation:
-                    continue
-                border.setdefault(t, []).append(tn)
-        return border
+        # Territories of nation next to an enemy, each with the enemy territories it borders, in
+        # territory id order
+        k = self.map.nation_index[nation]
+        owners, territories = self.state.owners, self.map.territories
+        return {
+            territories[i]: [territories[j] for j in self.map.neighbor_ids[i] if owners[j] != k]
+            for i in sorted(self.state.in_borders[k])
+        }
 
     def draw_card(self, player):
         if player.gets_card:
-            player.cards.append(random.choice(["1", "2", "3"]))
+            player.cards.append(self.card_rng.choice(["1", "2", "3"]))
             player.gets_card = False
 
     def win_condition(self):
         return len([p for p in self.players.values() if p.is_alive]) == 1
 
     def get_image(self):
+        self.sync_graph()
         self.renderer(self.g, self.round_num)
 
+    def start_turn(self, player):
+        self.turn_start = time.perf_counter()
+        player.deadline = self.turn_start + self.turn_budget if self.turn_budget is not None else None
+
+    def end_turn(self, player):
+        player.deadline = None
+        if self.turn_budget is None:
+            return
+        seconds = time.perf_counter() - self.turn_start
+        if seconds > self.turn_budget:
+            self.overruns.append((player.nation, self.ply, seconds))
+            nation = self.map.nation_index[player.nation]
+            self.events.emit(events.OVERRUN, nation, self.ply, seconds * 1000, self.turn_budget * 1000)
+
+    def open_replay(self, path, chunk_size=0):
+        # Starts the replay stream; every snapshot is appended and flushed as it is taken
+        self.replay = ReplayWriter(path, self.map, self.map_module, chunk_size=chunk_size)
+
     def save_snapshot(self, active):
         if active:
-            self.snapshots.append(copy.deepcopy(self.g))
+            if self.replay is None:
+                self.open_replay(f"{new_game_folder()}/replay.rsk")
+            self.replay.write(self.ply, self.state.owners, self.state.troops)
 
     def export_snapshots(self, active):
-        if active:
-            with open(f"{storage_folder}/snapshots.p", "wb") as f:
-                pickle.dump((self.renderer, self.snapshots), f)
+        if active and self.replay is not None:
+            self.replay.close()
 
     def __repr__(self):
         output = ""
@@ -234,25 +354,91 @@ class Game:
 
 
 def run(game, snapshots_on):
-    while True:
-        logging.debug(f"==========\nRound {game.round_num}")
-        logging.debug(game)
-        for player in game.players.values():
-            if player.is_alive:
-                game.save_snapshot(snapshots_on)
-                logging.debug(f"{player.nation} starting turn. Ply {game.ply}")
-                player.play_turn(game)
-                game.draw_card(player)
-                if game.win_condition():
-                    logging.debug(f"{player} wins!")
+    if snapshots_on and game.replay is None:
+        game.open_replay(f"{new_game_folder()}/replay.rsk")
+    try:
+        while True:
+            game.events.emit(events.ROUND, game.round_num)
+            if game.events.enabled:  # copying the board is only worth it if someone reads it
+                cards = [len(game.players[n].cards) for n in game.nations]
+                game.events.emit(events.STATE, game.state.owners[:], game.state.troops[:], cards)
+            for player in game.players.values():
+                if player.is_alive:
                     game.save_snapshot(snapshots_on)
-                    game.export_snapshots(snapshots_on)
-                    return player
-                game.ply += 1
-        game.round_num += 1
+                    game.events.emit(events.TURN, game.map.nation_index[player.nation], game.ply)
+                    game.start_turn(player)
+                    player.play_turn(game)
+                    game.end_turn(player)
+                    game.draw_card(player)
+                    if game.win_condition():
+                        game.events.emit(events.WIN, game.map.nation_index[player.nation])
+                        game.save_snapshot(snapshots_on)
+                        return player
+                    game.ply += 1
+            game.round_num += 1
+    finally:
+        # Closes the replay even if a player raised, so the plies played so far stay readable
+        game.export_snapshots(snapshots_on)
+
+
+def simulate(
+    players, seed=None, map_info=map_info, output_dir=None, snapshots=False, log=False, event_sink=None, record=False,
+    turn_budget=None, node_budget=None,
+):
+    # Plays one game and returns its result record. Nothing is written unless asked for: with
+    # output_dir set, log writes game.log and snapshots writes replay.rsk into it. With record set,
+    # the result also has the elimination order and the territories and troops per round.
+    # turn_budget (seconds) and node_budget limit every turn's decision, see Game.
+    if (log or snapshots) and output_dir is None:
+        raise ValueError("log and snapshots need an output_dir")
+    if sum([log, record, event_sink is not None]) > 1:
+        raise ValueError("log, record and event_sink each replace the event sink, pass only one")
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    if log:
+        event_sink = events.TextSink(map_info["map_index"], os.path.join(output_dir, "game.log"))
+
+    t0 = time.time()
+    game = Game(
+        map_info=map_info, players=copy.deepcopy(players), event_sink=event_sink, seed=seed,
+        turn_budget=turn_budget, node_budget=node_budget,
+    )
+    if record:
+        game.events = events.HistorySink(game)
+    if snapshots:
+        game.open_replay(os.path.join(output_dir, "replay.rsk"))
+    try:
+        winner = run(game, snapshots)
+    finally:
+        if log:
+            event_sink.close()
+    result = {
+        "seed": game.seed,
+        "players": {p.nation: type(p).__name__ for p in players},
+        "winner": winner.nation,
+        "plies": game.ply,
+        "rounds": game.round_num,
+        "seconds": time.time() - t0,
+        "overruns": game.overruns,
+    }
+    if record:
+        game.events.snapshot(game.round_num + 1)  # the final board
+        result["eliminations"] = [(game.map.nations[n], ply) for n, ply in game.events.eliminations]
+        result["history"] = game.events.rounds
+        result["nations"] = list(game.nations)  # the order of the history's columns
+    return result
 
 
 if __name__ == "__main__":
+    storage_folder = new_game_folder()
+    logging.basicConfig(
+        format="%(message)s",
+        filename=f"{storage_folder}/game.log",
+        filemode="w",
+        level=logging.DEBUG
+    )
+    logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
+    logging.getLogger('matplotlib.font_manager').disabled = True
 
     players = [Player6("A"), Player2("B"), Player2("C"), Player2("D")]
     counts = {}
@@ -261,11 +447,15 @@ if __name__ == "__main__":
     num_games = 1
 
     snapshots_on = True
+    event_sink = events.LoggingSink(map_info["map_index"])
     if num_games >= 10:
         snapshots_on = False
+        event_sink = None
         logging.getLogger().setLevel(logging.INFO)
     for i in range(num_games):
-        game = Game(map_info=copy.deepcopy(map_info), players=copy.deepcopy(players))
+        game = Game(map_info=map_info, players=copy.deepcopy(players), event_sink=event_sink)
+        if snapshots_on:
+            game.open_replay(f"{storage_folder}/replay.rsk")
         winner = run(game, snapshots_on)
         counts.setdefault(winner.nation, 0)
         counts[winner.nation] += 1
@@ -273,4 +463,5 @@ if __name__ == "__main__":
     logging.info(f"Results: {sorted(list(counts.items()), key=lambda x: -x[1])}".replace("'", ""))
     logging.info(f"{(time.time() - t0)*1000:.0f} ms")
     if num_games == 1:
+        from game_render import render  # matplotlib is only needed here
         render(storage_folder)
@@ -1,34 +1,38 @@
-import pandas as pd
-import networkx as nx
-import matplotlib.pyplot as plt
 from root_path import ROOT_PATH
+from game_state import MapIndex
+from maps.compile_map import load_compiled_map
 
 
-# df = pd.read_excel("standard_map_data.xlsx")
-territory_attributes = pd.read_excel(f"{ROOT_PATH}/maps/standard_map_data.xlsx", sheet_name=0).\
-    set_index("territory").to_dict('index')
-adjacency = pd.read_excel(f"{ROOT_PATH}/maps/standard_map_data.xlsx", sheet_name=1)
+# The spreadsheet is compiled once into classic.json, so loading the map needs neither pandas nor
+# networkx; it is recompiled automatically when the spreadsheet changes
+map_data = load_compiled_map(f"{ROOT_PATH}/maps/standard_map_data.xlsx", f"{ROOT_PATH}/maps/classic.json")
 
-g = nx.Graph()
-for i, row in adjacency.iterrows():
-    for j in range(len(row)):
-        if row[j] == 1:
-            g.add_edge(adjacency.columns[i+1], adjacency.columns[j])
+nations = ["A", "B", "C", "D"]
+continent_bonuses = {
+    "North America": 5, "South America": 2, "Africa": 3, "Europe": 5, "Asia": 7, "Oceania": 2
+}
+continents = map_data["continents"]
+
+map_index = MapIndex.from_compiled(map_data, nations, continent_bonuses)
 
-nx.set_node_attributes(g, territory_attributes)
 
-continents = {}
-for t in territory_attributes:
-    continents.setdefault(territory_attributes[t]["continent"], []).append(t)
+color_map = {
+    "A": "deepskyblue",
+    "B": "red",
+    "C": "yellow",
+    "D": "green",
+}
+
+
+def node_position(x, y):
+    # Map coordinates to pixels on map.png
+    return x*58 + 120, 490 - y*59
 
 
 def render(g, ply):
-    color_map = {
-        "A": "deepskyblue",
-        "B": "red",
-        "C": "yellow",
-        "D": "green",
-    }
+    import matplotlib.pyplot as plt  # imported lazily, headless simulations never render
+    import networkx as nx
+
     colors = [color_map[g.nodes[n]["nation"]] for n in g.nodes]
     troops = {n: g.nodes[n]["troops"] for n in g.nodes}
 
@@ -36,22 +40,61 @@ def render(g, ply):
 
     plt.imshow(plt.imread(f"{ROOT_PATH}/maps/map.png"), alpha=0.75)
 
-    nx.draw_networkx(g, pos={n: (g.nodes[n]["x"]*58 + 120, 490 - g.nodes[n]["y"]*59) for n in g.nodes}, node_color=colors, labels=troops, edgelist=[], node_size=100, font_size=8)
+    nx.draw_networkx(g, pos={n: node_position(g.nodes[n]["x"], g.nodes[n]["y"]) for n in g.nodes}, node_color=colors, labels=troops, edgelist=[], node_size=100, font_size=8)
 
     plt.text(10, 20, f"Ply: {ply}", fontsize=8)
     # plt.show()
 
 
+class FrameRenderer:
+    # Draws the background and the territory markers once; every frame only updates the marker
+    # colors and the troop labels, which is much cheaper than render() for long replays
+    def __init__(self, coordinates, nations):
+        import matplotlib.pyplot as plt
+
+        self.nations = nations
+        self.fig, self.ax = plt.subplots()
+        self.ax.imshow(plt.imread(f"{ROOT_PATH}/maps/map.png"), alpha=0.75)
+        positions = [node_position(x, y) for x, y in coordinates]
+        self.markers = self.ax.scatter([p[0] for p in positions], [p[1] for p in positions], s=100)
+        self.labels = [
+            self.ax.text(x, y, "", fontsize=8, horizontalalignment="center", verticalalignment="center")
+            for x, y in positions
+        ]
+        self.ply_text = self.ax.text(10, 20, "", fontsize=8)
+        self.ax.tick_params(left=False, bottom=False, labelleft=False, labelbottom=False)
+
+    def draw(self, ply, owners, troops):
+        self.markers.set_color([color_map[self.nations[o]] for o in owners])
+        for label, troop_count in zip(self.labels, troops):
+            label.set_text(str(troop_count))
+        self.ply_text.set_text(f"Ply: {ply}")
+        return [self.markers, self.ply_text] + self.labels
+
+    def save(self, path):
+        self.fig.savefig(path)
+
+    def close(self):
+        import matplotlib.pyplot as plt
+        plt.close(self.fig)
+
+
 map_info = {
-    "graph": g,
-    "nations": ["A", "B", "C", "D"],
-    "continent_bonuses": {
-        "North America": 5, "South America": 2, "Africa": 3, "Europe": 5, "Asia": 7, "Oceania": 2
-    },
+    "map_index": map_index,
+    "initial_nations": map_data["nation"],
+    "initial_troops": map_data["troops"],
+    "nations": nations,
+    "continent_bonuses": continent_bonuses,
     "continent_definition": continents,
     "renderer": render,
+    "module": __name__,
 }
 
 
 if __name__ == "__main__":
+    import networkx as nx
+
+    g = map_index.to_graph()
+    nx.set_node_attributes(g, dict(zip(map_index.territories, map_data["nation"])), "nation")
+    nx.set_node_attributes(g, dict(zip(map_index.territories, map_data["troops"])), "troops")
     render(g, 0)
@@ -0,0 +1,73 @@
+import os
+import sys
+import json
+import hashlib
+
+COMPILED_VERSION = 1
+
+
+def source_hash(source_path):
+    with open(source_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def compile_map(source_path):
+    # Reads the map spreadsheet (territory attributes on the first sheet, adjacency matrix on the
+    # second) into plain lists, with territories in graph order and the adjacency in CSR form
+    import pandas as pd
+    import networkx as nx
+
+    territory_attributes = pd.read_excel(source_path, sheet_name=0).set_index("territory").to_dict('index')
+    adjacency = pd.read_excel(source_path, sheet_name=1)
+
+    g = nx.Graph()
+    for i, row in adjacency.iterrows():
+        for j in range(len(row)):
+            if row.iloc[j] == 1:
+                g.add_edge(adjacency.columns[i+1], adjacency.columns[j])
+
+    territories = list(g.nodes)
+    index = {t: i for i, t in enumerate(territories)}
+    adj_offsets, adj_targets = [0], []
+    for t in territories:
+        adj_targets.extend(index[n] for n in g.neighbors(t))
+        adj_offsets.append(len(adj_targets))
+
+    continents = {}
+    for t in territory_attributes:
+        continents.setdefault(territory_attributes[t]["continent"], []).append(t)
+
+    return {
+        "version": COMPILED_VERSION,
+        "source_hash": source_hash(source_path),
+        "territories": territories,
+        "continent": [territory_attributes[t]["continent"] for t in territories],
+        "nation": [territory_attributes[t]["nation"] for t in territories],
+        "troops": [int(territory_attributes[t]["troops"]) for t in territories],
+        "x": [float(territory_attributes[t]["x"]) for t in territories],
+        "y": [float(territory_attributes[t]["y"]) for t in territories],
+        "continents": continents,
+        "adj_offsets": adj_offsets,
+        "adj_targets": adj_targets,
+    }
+
+
+def load_compiled_map(source_path, compiled_path):
+    # Uses the compiled map if it was built from the current spreadsheet, recompiles otherwise
+    data = None
+    if os.path.exists(compiled_path):
+        with open(compiled_path) as f:
+            data = json.load(f)
+        if data.get("version") != COMPILED_VERSION or data.get("source_hash") != source_hash(source_path):
+            data = None
+    if data is None:
+        data = compile_map(source_path)
+        with open(compiled_path, "w") as f:
+            json.dump(data, f)
+    return data
+
+
+if __name__ == "__main__":
+    source, compiled = sys.argv[1], sys.argv[2]
+    with open(compiled, "w") as f:
+        json.dump(compile_map(source), f)
@@ -0,0 +1,77 @@
+import time
+
+
+class AttackPath:
+    # A chain of attacks from an owned start territory through enemy territories. The troops left at
+    # the end stay on the last territory, or are fortified back to the start if fortify_home is set.
+    __slots__ = ("nodes", "end_troops", "fortify_home", "score")
+
+    def __init__(self, nodes, end_troops, fortify_home=False):
+        self.nodes = nodes
+        self.end_troops = end_troops
+        self.fortify_home = fortify_home
+        self.score = -1e10
+
+    @property
+    def nodes_list(self):
+        # Moves in play order, with the start repeated at the end for a fortify back home
+        return list(self.nodes) + [self.nodes[0]] if self.fortify_home else list(self.nodes)
+
+    @property
+    def holder(self):
+        return self.nodes[0] if self.fortify_home else self.nodes[-1]
+
+    def extend(self, territory, killed_troops):
+        return AttackPath(self.nodes + (territory,), self.end_troops - killed_troops)
+
+    def home_variant(self):
+        return AttackPath(self.nodes, self.end_troops, fortify_home=True)
+
+    def __repr__(self):
+        return f"{self.nodes_list} ({self.end_troops})"
+
+
+def find_attack_paths(game, nation, deploy, node_budget=1000, time_budget=None, beam_width=None, min_troops=3):
+    # Breadth-first expansion of attack paths that keep at least min_troops after every conquest.
+    # Paths from the same start over the same territories to the same end give the same position,
+    # so only the first of them is kept. With beam_width set, only the paths with the most troops
+    # left are expanded at every depth. The search stops after node_budget paths or time_budget
+    # seconds, whichever comes first, and returns the paths found so far.
+    deadline = time.perf_counter() + time_budget if time_budget is not None else None
+    owned = game.get_territories(nation)
+    frontier = [AttackPath((t,), game.get_troops(t) + deploy) for t in game.get_in_border(nation)]
+    seen = set()
+    paths = []
+    while frontier and len(paths) < node_budget:
+        if beam_width is not None and len(frontier) > beam_width:
+            frontier = sorted(frontier, key=lambda p: -p.end_troops)[:beam_width]
+        new_frontier = []
+        for path in frontier:
+            for neighbor in game.get_neighbors(path.nodes[-1]):
+                if neighbor in owned or neighbor in path.nodes:
+                    continue
+                enemy_troops = game.get_troops(neighbor)
+                if path.end_troops - enemy_troops < min_troops:
+                    continue
+                key = (path.nodes[0], neighbor, frozenset(path.nodes))
+                if key in seen:
+                    continue
+                seen.add(key)
+                new_path = path.extend(neighbor, enemy_troops)
+                new_frontier.append(new_path)
+                paths.append(new_path)
+                if len(paths) >= node_budget:
+                    return paths
+            if deadline is not None and time.perf_counter() > deadline:
+                return paths
+        frontier = new_frontier
+    return paths
+
+
+def with_home_variants(paths):
+    # Adds the fortify-back-home variant of every path; those only depend on the start and the
+    # territories taken, so one variant per such set is enough
+    variants = {}
+    for path in paths:
+        variants.setdefault((path.nodes[0], frozenset(path.nodes)), path)
+    return paths + [path.home_variant() for path in variants.values()]
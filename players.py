@@ -1,10 +1,16 @@
-import logging
+import math
 import random
-import copy
 import time
-import numpy as np
 
 import rules
+import events
+from path_search import AttackPath, find_attack_paths, with_home_variants
+
+
+def _numpy():
+    # Only the search-based players need numpy, so it is imported on their first use
+    import numpy
+    return numpy
 
 
 def get_set(cards):
@@ -26,38 +32,60 @@ def pop_card_set(cards):
 
 
 class Player:
+    # perf_counter time by which the current turn's decision should be made, set by the game while a
+    # turn budget is in force. Search-based players stop searching and scoring when it passes and
+    # play the best decision found so far.
+    deadline = None
+
     def __init__(self, nation):
         self.nation = nation
         self.cards = []
         self.is_alive = True
         self.gets_card = False
+        self.rng = random.Random()  # replaced by a seeded stream when the player joins a game
 
     def __repr__(self):
         return self.nation
 
+    def time_left(self):
+        # Seconds until the deadline, None without one
+        return None if self.deadline is None else self.deadline - time.perf_counter()
+
+    def out_of_time(self):
+        return self.deadline is not None and time.perf_counter() > self.deadline
+
+    def search_limits(self, game, node_budget, time_budget, share=0.5):
+        # The player's own search budgets, capped by the game's node budget and by a share of the
+        # time left in the turn; the rest is kept for scoring what the search found
+        if game.node_budget is not None:
+            node_budget = min(node_budget, game.node_budget)
+        left = self.time_left()
+        if left is not None:
+            left = max(left * share, 0)
+            time_budget = left if time_budget is None else min(time_budget, left)
+        return node_budget, time_budget
+
     def get_deployment(self, game):
         n = game.get_deploy_num(self.nation)
-        logging.debug(
-            f"{self} gets {n} troops from {len(game.get_territories(self.nation))} territories."
-        )
+        game.events.emit(events.INCOME, game.map.nation_index[self.nation], n, len(game.get_territories(self.nation)))
         return n
 
     def deploy(self, game, territory, num_troops):
-        logging.debug(f"{self} deploys {num_troops} on {territory}")
+        game.events.emit(events.DEPLOY, game.map.nation_index[self.nation], game.map.index[territory], num_troops)
         game.adjust_troops(territory, num_troops)
 
     def trade_cards(self, game):
         card_set = pop_card_set(self.cards)
         if card_set:
-            logging.debug(f"{self.nation} traded cards for {rules.CARD_BONUS} troops.")
+            game.events.emit(events.CARDS, game.map.nation_index[self.nation], rules.CARD_BONUS)
             return rules.CARD_BONUS
         return 0
 
     def play_turn(self, game):
         # Attack a random neighboring territory
         targets = game.get_out_border(self.nation)
-        target = random.choice(list(targets.keys()))
-        source = random.choice(targets[target])
+        target = self.rng.choice(list(targets.keys()))
+        source = self.rng.choice(targets[target])
 
         deployment = self.get_deployment(game)
         deployment += self.trade_cards(game)
@@ -72,8 +100,8 @@ class Player:
         if len(self.cards) >= 5 and not game.win_condition():
             deployment = self.trade_cards(game)
             targets = game.get_out_border(self.nation)
-            target = random.choice(list(targets.keys()))
-            source = random.choice(targets[target])
+            target = self.rng.choice(list(targets.keys()))
+            source = self.rng.choice(targets[target])
             game.adjust_troops(source, deployment)
 
         # reinforce // skip
@@ -138,26 +166,19 @@ class Player2(Player):
 class Player3(Player):
 
     def _get_continent_data(self, game):
-        enemy_troops_by_continent = {c: 0 for c in game.continents}
-        unowned_territories_per_continent = {c: 0 for c in game.continents}
+        enemy_troops_by_continent = {}
+        unowned_territories_per_continent = {}
         enemy_continents = set()
         my_continents = set()
-        for t in game.get_all_territories():
-            if game.get_nation(t) != self.nation:
-                enemy_troops_by_continent[game.get_continent(t)] += game.get_troops(t)
-                unowned_territories_per_continent[game.get_continent(t)] += 1
         for c, ts in game.continents.items():
-            is_whole = True
-            nation = game.get_nation(ts[0])  # candidate for continent ownership
-            for t in ts[1:]:
-                if game.get_nation(t) != nation:  # no continent
-                    is_whole = False
-                    break
-            if is_whole:
-                if nation == self.nation:
-                    my_continents.add(c)
-                else:
-                    enemy_continents.add(c)
+            enemy_troops_by_continent[c] = \
+                game.get_continent_troops(c) - game.get_continent_troops(c, self.nation)
+            unowned_territories_per_continent[c] = len(ts) - game.get_continent_count(c, self.nation)
+            nation = game.get_continent_owner(c)
+            if nation == self.nation:
+                my_continents.add(c)
+            elif nation is not None:
+                enemy_continents.add(c)
         return enemy_troops_by_continent, unowned_territories_per_continent, enemy_continents, my_continents
 
     def fight_scores(self, game):
@@ -230,7 +251,7 @@ class Player3(Player):
         if len(fight_scores) > 0:
             source, target, score = sorted(fight_scores, key=lambda x: -x[2])[0]
         else:
-            source = game.get_territories(self.nation)[0]
+            source = next(iter(game.get_territories(self.nation)))
 
         # DEPLOY
         deploy_num = self.get_deployment(game) + self.trade_cards(game)
@@ -255,15 +276,20 @@ class Player3(Player):
                     - game.get_troops(t)
             )
         fortify_scores_ranked = sorted(list(fortify_scores_by_source.items()), key=lambda x: -x[1])
+        # The best pair within a connected component moves troops from its lowest to its highest
+        # score; ties go to the earliest ranked source, then target
+        components = {}
+        for rank, (t, score) in enumerate(fortify_scores_ranked):
+            components.setdefault(game.get_component(t), []).append((rank, t, score))
         fortify_pairs = []
-        for source, ss in fortify_scores_ranked:
-            for target, ts in fortify_scores_ranked:
-                if source == target:
-                    continue
-                if game.has_path(source, target):
-                    fortify_pairs.append((source, target, ts - ss))
+        for members in components.values():
+            if len(members) < 2:
+                continue
+            source_rank, source, ss = min(members, key=lambda x: (x[2], x[0]))
+            _, target, ts = min([m for m in members if m[1] != source], key=lambda x: (-x[2], x[0]))
+            fortify_pairs.append((source_rank, source, target, ts - ss))
         if len(fortify_pairs) > 0:
-            source, target, troop_request = sorted(fortify_pairs, key=lambda x: -x[2])[0]
+            _, source, target, troop_request = sorted(fortify_pairs, key=lambda x: (-x[3], x[0]))[0]
             troops = min(troop_request, game.get_troops(source) - 1)
             if troops > 0:
                 game.fortify(source, target, troops)
@@ -273,10 +299,10 @@ class Player4(Player2):
 
 
     def ranked_targets(self, game):
-        enemy_troops_by_continent = {c: 0 for c in game.continents}
-        for t in game.get_all_territories():
-            if game.get_nation(t) != self.nation:
-                enemy_troops_by_continent[game.get_continent(t)] += game.get_troops(t)
+        enemy_troops_by_continent = {
+            c: game.get_continent_troops(c) - game.get_continent_troops(c, self.nation)
+            for c in game.continents
+        }
         continent_attraction = {}
         for c, enemy_troops in enemy_troops_by_continent.items():
             if enemy_troops_by_continent[c] == 0:
@@ -341,6 +367,10 @@ class Player4(Player2):
 
 
 class Player5(Player2):
+    # Attack path search limits
+    node_budget = 1000
+    time_budget = None
+    beam_width = None
 
     def get_position_score(self, game):
         troop_count = game.get_total_troops(self.nation)
@@ -352,78 +382,40 @@ class Player5(Player2):
         )
         return score
 
-    class Path:
-        def __init__(self, start_territory, troops):
-            self.nodes_list = [start_territory]
-            self.node_set = {start_territory}
-            self.end_troops = troops
-            self.score = -1e10
-
-        def add(self, territory, killed_troops):
-            self.nodes_list.append(territory)
-            self.node_set.add(territory)
-            self.end_troops -= killed_troops
-
     def play_turn(self, game):
         # Deploy
         deploy = self.get_deployment(game) + self.trade_cards(game)
 
         # Create paths
-        in_border = game.get_in_border(self.nation)
-        owned_territories = copy.deepcopy(game.get_territories(self.nation))
-        paths = []  # TODO set explorable paths here to allow no attacks (fix cards)
         t0 = time.time()
-        explorable_paths = [self.Path(t, game.get_troops(t) + deploy) for t in in_border]
-        while len(paths) < 1e3:
-            new_paths = []
-            for path in explorable_paths:
-                end = path.nodes_list[-1]
-                neighbors = game.get_neighbors(end)
-                for neighbor in neighbors:
-                    if neighbor in owned_territories or neighbor in path.node_set:
-                        continue
-                    enemy_troops = game.get_troops(neighbor)
-                    if path.end_troops - enemy_troops >= 3:
-                        new_path = copy.deepcopy(path)
-                        new_path.add(neighbor, killed_troops=enemy_troops)
-                        # TODO manage killed troops better
-                        # TODO manage stop point more flexibly
-                        new_paths.append(new_path)
-            if new_paths:
-                explorable_paths = new_paths
-                paths.extend(explorable_paths)
-            else:
-                break
-        logging.debug(f"Found {len(paths)} paths in {(time.time()-t0)*1000:.0f} ms")
+        # TODO allow no attacks (fix cards)
+        node_budget, time_budget = self.search_limits(game, self.node_budget, self.time_budget)
+        paths = find_attack_paths(game, self.nation, deploy, node_budget, time_budget, self.beam_width)
+        game.events.emit(events.SEARCH, game.map.nation_index[self.nation], len(paths), (time.time()-t0)*1000)
 
         t0 = time.time()
         # Evaluate paths
-        eval_game = copy.deepcopy(game)
-        # eval_game = game  # TODO remove the deepcopy
         for path in paths:
-            # Create eval game
-            revert_nodes = []
-            for t in path.nodes_list:
-                revert_nodes.append({
-                    "territory": t,
-                    "nation": game.get_nation(t),
-                    "troops": game.get_troops(t)
-                })
-                eval_game.set_nation(t, self.nation)
-                eval_game.set_troops(t, 1 if t != path.nodes_list[-1] else path.end_troops)
-            path.score = self.get_position_score(eval_game)
-            # Revert eval game
-            for rn in revert_nodes:
-                eval_game.set_nation(rn["territory"], rn["nation"])
-                eval_game.set_troops(rn["territory"], rn["troops"])
+            # Play the path out on the game itself and undo it after scoring
+            checkpoint = game.checkpoint()
+            for t in path.nodes:
+                game.set_nation(t, self.nation)
+                game.set_troops(t, 1 if t != path.holder else path.end_troops)
+            path.score = self.get_position_score(game)
+            game.rollback(checkpoint)
+            if self.out_of_time():
+                break  # the paths left unscored can't be chosen
 
         # Get best path
         if len(paths) == 0:
-            best_path = self.Path(next(iter(game.get_territories(self.nation))), 0)
+            best_path = AttackPath((next(iter(game.get_territories(self.nation))),), 0)
         else:
             best_path = sorted(paths, key=lambda x: -x.score)[0]
-        logging.debug(f"Found best path, score: {best_path.score} in {(time.time()-t0)*1000:.0f} ms")
-        logging.debug(f"Best path: {best_path.nodes_list}")
+        if game.events.enabled:
+            path = [game.map.index[t] for t in best_path.nodes_list]
+            game.events.emit(
+                events.CHOICE, game.map.nation_index[self.nation], best_path.score, path, (time.time()-t0)*1000
+            )
 
         # Play best path
         # Deploy
@@ -459,6 +451,10 @@ class Player5(Player2):
 
 
 class Player6(Player2):
+    # Attack path search limits
+    node_budget = 1000
+    time_budget = None
+    beam_width = None
 
     def __init__(self, nation):
         # self.dna = dna
@@ -468,7 +464,7 @@ class Player6(Player2):
         troop_count = game.get_total_troops(self.nation)
         deploy_num = game.get_deploy_num(self.nation)
         other_nation_territories = \
-            len(game.territory_ownership) - len(game.get_territories(self.nation))
+            len(game.map) - len(game.get_territories(self.nation))
 
         in_border = game.get_in_border(self.nation)
         out_border = game.get_in_border(self.nation)
@@ -480,10 +476,12 @@ class Player6(Player2):
                     protective_border.append(t)
                     break
 
+        np = _numpy()
+
         border_strength = 0
         if protective_border:
             border_strength = np.power(
-                np.product([game.get_troops(t) for t in protective_border]),
+                np.prod([game.get_troops(t) for t in protective_border]),
                 1/len(protective_border)
             )
         border_strength = min(border_strength, max([game.get_troops(t) for t in out_border]+[10]))
@@ -503,84 +501,152 @@ class Player6(Player2):
         )
         return score
 
-    class Path:
-        def __init__(self, start_territory, troops):
-            self.nodes_list = [start_territory]
-            self.node_set = {start_territory}
-            self.end_troops = troops
-            self.score = -1e10
+    def score_paths(self, game, paths):
+        # Scores every path as get_position_score would after playing it out, but as a delta
+        # against the current position: only the terms and territories a path touches are
+        # recomputed, and the terms are combined for all paths at once
+        np = _numpy()
+
+        m, state = game.map, game.state
+        me = m.nation_index[self.nation]
+        owners, troops = state.owners, state.troops
+        counts = [sum(c) for c in state.continent_counts]
+        sizes = [len(ts) for ts in m.continent_territories]
+
+        # Border classification of the current position
+        in_border = [owners[i] == me and state.nation_adjacent[me][i] < len(m.neighbor_ids[i]) for i in range(len(m))]
+        in_land = [owners[i] == me and not in_border[i] for i in range(len(m))]
+        protective = [in_border[i] and any(in_land[j] for j in m.neighbor_ids[i]) for i in range(len(m))]
+        base_log_sum = sum(math.log(troops[i]) for i in range(len(m)) if protective[i])
+        base_protective = sum(protective)
+        border_by_troops = sorted([i for i in range(len(m)) if in_border[i]], key=lambda i: -troops[i])
+
+        n = len(paths)
+        troop_count = np.empty(n)
+        deploy_num = np.empty(n)
+        log_sum = np.empty(n)
+        num_protective = np.empty(n)
+        border_cap = np.empty(n)
+        other_production = np.empty(n)
+        other_territories = np.empty(n)
+        for p, path in enumerate(paths):
+            if p and self.out_of_time():
+                n = p  # only the paths scored so far compete
+                break
+            nodes = [m.index[t] for t in path.nodes]
+            conquered = set(nodes[1:])
+            holder = m.index[path.holder]
+
+            def owned(i):
+                return owners[i] == me or i in conquered
+
+            def new_troops(i):
+                return path.end_troops if i == holder else 1 if i in conquered or i == nodes[0] else troops[i]
+
+            # Troops, territory counts and continent bonuses
+            troop_count[p] = state.nation_troops[me] - troops[nodes[0]] + path.end_troops + len(conquered)
+            lost = [0] * len(m.nations)
+            taken = {}
+            for i in conquered:
+                lost[owners[i]] += 1
+                c = m.territory_continent[i]
+                taken[c] = taken.get(c, 0) + 1
+            bonus = [state.continent_bonus[k] for k in range(len(m.nations))]
+            for c, num_taken in taken.items():
+                if state.continent_counts[me][c] + num_taken == sizes[c]:
+                    bonus[me] += m.continent_bonuses[c]
+                for k in range(len(m.nations)):
+                    if k != me and state.continent_counts[k][c] == sizes[c]:
+                        bonus[k] -= m.continent_bonuses[c]
+            deploy_num[p] = max((counts[me] + len(conquered)) // 3, 3) + bonus[me]
+            other_production[p] = sum(
+                max((counts[k] - lost[k]) // 3, 3) + bonus[k] for k in range(len(m.nations)) if k != me
+            )
+            other_territories[p] = len(m) - counts[me] - len(conquered)
+
+            # Border status can only change within one step of the path, protection within two
+            near = set(nodes)
+            for i in nodes:
+                near.update(m.neighbor_ids[i])
+            reach = set(near)
+            for i in near:
+                reach.update(m.neighbor_ids[i])
+            new_in_border = {
+                i: owned(i) and any(not owned(j) for j in m.neighbor_ids[i]) for i in near
+            }
+
+            def is_in_land(i):
+                if i in near:
+                    return owned(i) and not new_in_border[i]
+                return in_land[i]
+
+            total, count = base_log_sum, base_protective
+            for i in reach:
+                if protective[i]:
+                    total -= math.log(troops[i])
+                    count -= 1
+                if i in near and new_in_border[i] or i not in near and in_border[i]:
+                    if any(is_in_land(j) for j in m.neighbor_ids[i]):
+                        total += math.log(new_troops(i))
+                        count += 1
+            log_sum[p], num_protective[p] = total, count
+
+            cap = 10
+            for i in border_by_troops:
+                if i not in near:
+                    cap = max(cap, troops[i])
+                    break
+            for i, is_border in new_in_border.items():
+                if is_border:
+                    cap = max(cap, new_troops(i))
+            border_cap[p] = cap
+        troop_count, deploy_num, log_sum, num_protective, border_cap, other_production, other_territories = (
+            a[:n] for a in (
+                troop_count, deploy_num, log_sum, num_protective, border_cap, other_production, other_territories
+            )
+        )
 
-        def add(self, territory, killed_troops):
-            self.nodes_list.append(territory)
-            self.node_set.add(territory)
-            self.end_troops -= killed_troops
+        with np.errstate(divide="ignore", invalid="ignore"):
+            border_strength = np.where(num_protective > 0, np.exp(log_sum / np.maximum(num_protective, 1)), 0)
+        border_strength = np.minimum(border_strength, border_cap)
+        scores = (
+            troop_count
+            + deploy_num * 2
+            + border_strength
+            - other_production * 0.5
+            + 1000 * (other_territories == 0)
+        )
+        for path, score in zip(paths, scores):
+            path.score = float(score)
 
     def play_turn(self, game):
         # Deploy
         deploy = self.get_deployment(game) + self.trade_cards(game)
 
         # Create paths
-        in_border = game.get_in_border(self.nation)
-        owned_territories = copy.deepcopy(game.get_territories(self.nation))
-        paths = []  # TODO set explorable paths here to allow no attacks (fix cards)
         t0 = time.time()
-        explorable_paths = [self.Path(t, game.get_troops(t) + deploy) for t in in_border]
-        while len(paths) < 1e3:
-            new_paths = []
-            for path in explorable_paths:
-                end = path.nodes_list[-1]
-                neighbors = game.get_neighbors(end)
-                for neighbor in neighbors:
-                    if neighbor in owned_territories or neighbor in path.node_set:
-                        continue
-                    enemy_troops = game.get_troops(neighbor)
-                    if path.end_troops - enemy_troops >= 3:
-                        new_path = copy.deepcopy(path)
-                        new_path.add(neighbor, killed_troops=enemy_troops)
-                        # TODO manage killed troops better
-                        # TODO manage stop point more flexibly
-                        new_paths.append(new_path)
-            if new_paths:
-                explorable_paths = new_paths
-                paths.extend(explorable_paths)
-            else:
-                break
+        # TODO allow no attacks (fix cards)
+        node_budget, time_budget = self.search_limits(game, self.node_budget, self.time_budget)
+        paths = find_attack_paths(game, self.nation, deploy, node_budget, time_budget, self.beam_width)
 
-        # Create a copy of each path that fortifies to start
-        for i in range(len(paths)):
-            home_fort_alt_path = copy.deepcopy(paths[i])
-            home_fort_alt_path.nodes_list.append(home_fort_alt_path.nodes_list[0])
-            paths.append(home_fort_alt_path)
-        logging.debug(f"Found {len(paths)} paths in {(time.time()-t0)*1000:.0f} ms")
+        # Add the variant of each path that fortifies to start
+        paths = with_home_variants(paths)
+        game.events.emit(events.SEARCH, game.map.nation_index[self.nation], len(paths), (time.time()-t0)*1000)
 
         t0 = time.time()
         # Evaluate paths
-        eval_game = copy.deepcopy(game)
-        # eval_game = game  # TODO remove the deepcopy
-        for path in paths:
-            # Create eval game
-            revert_nodes = []
-            for t in path.nodes_list:
-                revert_nodes.append({
-                    "territory": t,
-                    "nation": game.get_nation(t),
-                    "troops": game.get_troops(t)
-                })
-                eval_game.set_nation(t, self.nation)
-                eval_game.set_troops(t, 1 if t != path.nodes_list[-1] else path.end_troops)
-            path.score = self.get_position_score(eval_game)
-            # Revert eval game
-            for rn in revert_nodes:
-                eval_game.set_nation(rn["territory"], rn["nation"])
-                eval_game.set_troops(rn["territory"], rn["troops"])
+        self.score_paths(game, paths)
 
         # Get best path
         if len(paths) == 0:
-            best_path = self.Path(next(iter(game.get_territories(self.nation))), 0)
+            best_path = AttackPath((next(iter(game.get_territories(self.nation))),), 0)
         else:
             best_path = sorted(paths, key=lambda x: -x.score)[0]
-        logging.debug(f"Found best path, score: {best_path.score} in {(time.time()-t0)*1000:.0f} ms")
-        logging.debug(f"Best path: {best_path.nodes_list}")
+        if game.events.enabled:
+            path = [game.map.index[t] for t in best_path.nodes_list]
+            game.events.emit(
+                events.CHOICE, game.map.nation_index[self.nation], best_path.score, path, (time.time()-t0)*1000
+            )
 
         # Play best path
         # Deploy
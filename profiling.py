@@ -0,0 +1,125 @@
+import sys
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+# Phases timed by the profiler as (phase, attribute): methods of the game and player classes and
+# functions in the modules that define them. Times are inclusive, so e.g. "attack" contains "dice"
+# and "turn" contains everything a player does in its turn.
+GAME_PHASES = [
+    ("attack", "battle"),
+    ("fortify", "fortify"),
+    ("has_path", "has_path"),
+    ("borders", "get_in_border"),
+    ("borders", "get_out_border"),
+]
+GAME_MODULE_PHASES = [("dice", "resolve_battle")]
+PLAYER_PHASES = [
+    ("turn", "play_turn"),
+    ("deploy", "deploy"),
+    ("scoring", "get_position_score"),
+    ("scoring", "score_paths"),
+]
+PLAYER_MODULE_PHASES = [("path_search", "find_attack_paths")]
+FIELDS = ["player", "nation", "phase", "calls", "seconds"]
+
+
+class Profiler:
+    # Call counts and time per (player class, nation, phase). Nothing is timed unless a game is
+    # attached: attach() swaps timing wrappers into the game and player classes for the duration of
+    # a with block, so a game played without a profiler runs the original code.
+    def __init__(self):
+        self.stats = {}  # (player, nation, phase) -> [calls, seconds]
+        self.current = ("", "")  # player class and nation whose turn it is
+
+    def _timed(self, phase, function, sets_current=False):
+        stats, clock = self.stats, time.perf_counter
+
+        def wrapper(*args, **kwargs):
+            previous = self.current
+            if sets_current:
+                self.current = (type(args[0]).__name__, args[0].nation)
+            t0 = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stat = stats.setdefault(self.current + (phase,), [0, 0.0])
+                stat[0] += 1
+                stat[1] += clock() - t0
+                self.current = previous
+        return wrapper
+
+    def attach(self, game):
+        return self.attach_classes(type(game), [type(p) for p in game.players.values()])
+
+    @contextmanager
+    def attach_classes(self, game_class, player_classes):
+        # Originals are looked up before anything is patched, so a subclass that inherits a method
+        # from another patched class still gets a single wrapper
+        targets = []
+        for phase, name in GAME_PHASES:
+            targets.append((game_class, name, phase, False))
+        for phase, name in GAME_MODULE_PHASES:
+            targets.append((sys.modules[game_class.__module__], name, phase, False))
+        for player_class in set(player_classes):
+            for phase, name in PLAYER_PHASES:
+                if hasattr(player_class, name):
+                    targets.append((player_class, name, phase, name == "play_turn"))
+            for phase, name in PLAYER_MODULE_PHASES:
+                module = sys.modules[player_class.__module__]
+                if hasattr(module, name) and (module, name, phase, False) not in targets:
+                    targets.append((module, name, phase, False))
+
+        patched = []
+        for owner, name, phase, sets_current in targets:
+            original = owner.__dict__.get(name)
+            patched.append((owner, name, original, self._timed(phase, getattr(owner, name), sets_current)))
+        try:
+            for owner, name, _, wrapper in patched:
+                setattr(owner, name, wrapper)
+            yield self
+        finally:
+            for owner, name, original, _ in reversed(patched):
+                if original is None:
+                    delattr(owner, name)
+                else:
+                    setattr(owner, name, original)
+
+    def rows(self):
+        return [
+            {"player": player, "nation": nation, "phase": phase, "calls": calls, "seconds": seconds}
+            for (player, nation, phase), (calls, seconds) in sorted(self.stats.items())
+        ]
+
+    def merge(self, rows):
+        # Adds rows from another profiler, e.g. one returned by a tournament worker
+        for row in rows:
+            stat = self.stats.setdefault((row["player"], row["nation"], row["phase"]), [0, 0.0])
+            stat[0] += row["calls"]
+            stat[1] += row["seconds"]
+
+    def by_player(self):
+        # Totals per player class and phase over all seats
+        totals = {}
+        for (player, _, phase), (calls, seconds) in self.stats.items():
+            stat = totals.setdefault((player, phase), [0, 0.0])
+            stat[0] += calls
+            stat[1] += seconds
+        return totals
+
+    def export(self, path):
+        # JSON or CSV, depending on the file extension
+        with open(path, "w", newline="") as f:
+            if path.endswith(".csv"):
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(self.rows())
+            else:
+                json.dump(self.rows(), f, indent=1)
+
+    def report(self):
+        lines = []
+        for (player, phase), (calls, seconds) in sorted(self.by_player().items(), key=lambda x: -x[1][1]):
+            lines.append(f"{player:>10} {phase:<12} {calls:>9} calls {seconds:9.3f} s {seconds/calls*1e6:9.1f} us/call")
+        return "\n".join(lines)
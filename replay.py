@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import zlib
+import struct
+import importlib
+
+# Replay file layout (little-endian):
+#   magic "RSKR", format version (u16), header length (u32), header JSON with the static map
+#   then one record per snapshot: kind (u8), ply (u32), count (u32) and a payload. Keyframes list
+#   every territory and deltas only the territories that changed since the previous record, as
+#   count (territory id u16, owner id u8, troops u32) entries. A chunk holds count bytes of zlib
+#   compressed keyframe/delta records, and an end record marks a finished game.
+# The file is append-only and flushed after every record, so it can be read while being written.
+MAGIC = b"RSKR"
+VERSION = 2
+KEYFRAME, DELTA, CHUNK, END = 0, 1, 2, 3
+_PREAMBLE = struct.Struct("<4sHI")
+_RECORD = struct.Struct("<BII")
+_ENTRY = struct.Struct("<HBI")
+
+
+class ReplayWriter:
+    # With chunk_size set, records are compressed in chunks of that many snapshots; only the
+    # current chunk is held in memory
+    def __init__(self, path, map_index, map_module, keyframe_interval=50, chunk_size=0):
+        self.file = open(path, "wb")
+        self.keyframe_interval = keyframe_interval
+        self.chunk_size = chunk_size
+        self.chunk = bytearray()
+        self.chunk_frames = 0
+        self.frames = 0
+        self.ply = 0
+        self.owners = None
+        self.troops = None
+        header = json.dumps({
+            "map": map_module,
+            "territories": map_index.territories,
+            "nations": map_index.nations,
+            "coordinates": map_index.coordinates,
+            "keyframe_interval": keyframe_interval,
+        }).encode()
+        self.file.write(_PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        self.file.write(header)
+        self.file.flush()
+
+    def write(self, ply, owners, troops):
+        if self.owners is None or self.frames % self.keyframe_interval == 0:
+            kind, changed = KEYFRAME, range(len(owners))
+        else:
+            kind = DELTA
+            changed = [
+                i for i in range(len(owners)) if owners[i] != self.owners[i] or troops[i] != self.troops[i]
+            ]
+        record = bytearray(_RECORD.pack(kind, ply, len(changed)))
+        for i in changed:
+            record += _ENTRY.pack(i, owners[i], troops[i])
+        self.owners, self.troops = owners[:], troops[:]
+        self.frames += 1
+        self.ply = ply
+
+        if self.chunk_size:
+            self.chunk += record
+            self.chunk_frames += 1
+            if self.chunk_frames == self.chunk_size:
+                self._write_chunk()
+        else:
+            self.file.write(record)
+            self.file.flush()
+
+    def _write_chunk(self):
+        if self.chunk_frames:
+            payload = zlib.compress(bytes(self.chunk))
+            self.file.write(_RECORD.pack(CHUNK, self.ply, len(payload)) + payload)
+            self.file.flush()
+            self.chunk = bytearray()
+            self.chunk_frames = 0
+
+    def close(self):
+        if not self.file.closed:
+            self._write_chunk()
+            self.file.write(_RECORD.pack(END, self.ply, 0))
+            self.file.close()
+
+
+class ReplayReader:
+    # Random access to the frames of a replay. refresh() picks up records appended since the file
+    # was opened, so a game can be read while it is still being played.
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.buffer = b""
+        self.header = None
+        self.records = []  # (kind, ply, entries)
+        self.finished = False
+        self.refresh()
+        if self.header is None:
+            raise ValueError(f"{path} is not a version {VERSION} replay")
+
+    def refresh(self):
+        self.buffer += self.file.read()
+        offset = 0
+        if self.header is None:
+            if len(self.buffer) < _PREAMBLE.size:
+                return 0
+            magic, version, header_len = _PREAMBLE.unpack_from(self.buffer, 0)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{self.file.name} is not a version {VERSION} replay")
+            if len(self.buffer) < _PREAMBLE.size + header_len:
+                return 0
+            self.header = json.loads(self.buffer[_PREAMBLE.size:_PREAMBLE.size + header_len])
+            self.territories = self.header["territories"]
+            self.nations = self.header["nations"]
+            offset = _PREAMBLE.size + header_len
+        num_records = len(self.records)
+        offset = self._parse(self.buffer, offset)
+        self.buffer = self.buffer[offset:]  # keep only an incomplete trailing record
+        return len(self.records) - num_records
+
+    def _parse(self, data, offset):
+        while offset + _RECORD.size <= len(data):
+            kind, ply, count = _RECORD.unpack_from(data, offset)
+            size = count if kind == CHUNK else count * _ENTRY.size
+            if offset + _RECORD.size + size > len(data):
+                break
+            payload = data[offset + _RECORD.size:offset + _RECORD.size + size]
+            if kind == CHUNK:
+                self._parse(zlib.decompress(payload), 0)
+            elif kind == END:
+                self.finished = True
+            else:
+                self.records.append((kind, ply, payload))
+            offset += _RECORD.size + size
+        return offset
+
+    def close(self):
+        self.file.close()
+
+    def __len__(self):
+        return len(self.records)
+
+    @staticmethod
+    def _apply(record, owners, troops):
+        for territory, owner, troop_count in _ENTRY.iter_unpack(record[2]):
+            owners[territory] = owner
+            troops[territory] = troop_count
+
+    def frame(self, i):
+        # Replays from the last keyframe at or before frame i; returns (ply, owners, troops)
+        start = i
+        while self.records[start][0] != KEYFRAME:
+            start -= 1
+        owners, troops = [0] * len(self.territories), [0] * len(self.territories)
+        for record in self.records[start:i + 1]:
+            self._apply(record, owners, troops)
+        return self.records[i][1], owners, troops
+
+    def frames(self, start=0, stop=None):
+        # Frames start..stop-1 in order, replaying from the keyframe at or before start
+        stop = len(self.records) if stop is None else stop
+        first = start
+        while first > 0 and self.records[first][0] != KEYFRAME:
+            first -= 1
+        owners, troops = [0] * len(self.territories), [0] * len(self.territories)
+        for i in range(first, stop):
+            self._apply(self.records[i], owners, troops)
+            if i >= start:
+                yield self.records[i][1], owners[:], troops[:]
+
+    def __iter__(self):
+        return self.frames()
+
+    def follow(self, poll_interval=0.5, timeout=None):
+        # Yields frames as they are written until the game ends, or until no new frame arrived
+        # for timeout seconds
+        owners, troops = [0] * len(self.territories), [0] * len(self.territories)
+        i = 0
+        last_frame = time.time()
+        while True:
+            while i < len(self.records):
+                self._apply(self.records[i], owners, troops)
+                yield self.records[i][1], owners[:], troops[:]
+                i += 1
+                last_frame = time.time()
+            if self.finished or timeout is not None and time.time() - last_frame > timeout:
+                return
+            time.sleep(poll_interval)
+            self.refresh()
+
+    def renderer(self):
+        return importlib.import_module(self.header["map"]).render
+
+    def frame_renderer(self):
+        return importlib.import_module(self.header["map"]).FrameRenderer(self.header["coordinates"], self.nations)
+
+    def graph(self, owners, troops, g=None):
+        # networkx graph of a frame in the layout the map renderers expect
+        import networkx as nx
+
+        if g is None:
+            g = nx.Graph()
+            for t, (x, y) in zip(self.territories, self.header["coordinates"]):
+                g.add_node(t, x=x, y=y)
+        for i, t in enumerate(self.territories):
+            g.nodes[t]["nation"] = self.nations[owners[i]]
+            g.nodes[t]["troops"] = troops[i]
+        return g
+
+
+if __name__ == "__main__":
+    # Tail a replay: python replay.py past_games/<game>/replay.rsk
+    import sys
+
+    while not os.path.exists(sys.argv[1]):
+        time.sleep(0.5)
+    reader = ReplayReader(sys.argv[1])
+    for ply, owners, troops in reader.follow():
+        counts = {n: owners.count(k) for k, n in enumerate(reader.nations)}
+        print(f"Ply {ply}: {counts}")
@@ -0,0 +1,172 @@
+import os
+import json
+import sqlite3
+import hashlib
+import inspect
+import logging
+import argparse
+
+import players as players_module
+
+# Files whose changes can change any game's result; a player's own code is versioned per class
+ENGINE_FILES = [
+    "main.py", "battle.py", "rules.py", "game_state.py", "path_search.py", "maps/classic.json", "maps/classic.py",
+]
+ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# One row per game in games, keyed by lineup (the player classes in seat order, comma separated),
+# seed and version; eliminations and rounds hold the elimination order and the territories and
+# troops of every nation at the start of each round (plus the final board).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    lineup TEXT NOT NULL,
+    version TEXT NOT NULL,
+    seed INTEGER NOT NULL,
+    players TEXT NOT NULL,
+    winner TEXT NOT NULL,
+    winner_class TEXT NOT NULL,
+    plies INTEGER NOT NULL,
+    rounds INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    UNIQUE (lineup, seed, version)
+);
+CREATE TABLE IF NOT EXISTS eliminations (
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    position INTEGER NOT NULL,
+    nation TEXT NOT NULL,
+    ply INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    game_id INTEGER NOT NULL REFERENCES games (id),
+    round INTEGER NOT NULL,
+    nation TEXT NOT NULL,
+    territories INTEGER NOT NULL,
+    troops INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_version ON games (version, lineup);
+CREATE INDEX IF NOT EXISTS games_winner ON games (lineup, version, winner_class);
+CREATE INDEX IF NOT EXISTS eliminations_game ON eliminations (game_id);
+CREATE INDEX IF NOT EXISTS rounds_game ON rounds (game_id, round);
+"""
+
+
+def lineup_version(lineup):
+    # Changes when the engine, the module-level helpers of players.py (card sets) or the code of
+    # any class in the lineup (or its base classes) changes, but not when an unrelated player is added
+    h = hashlib.sha256()
+    for path in ENGINE_FILES:
+        with open(os.path.join(ROOT_PATH, path), "rb") as f:
+            h.update(f.read())
+    for _, function in inspect.getmembers(players_module, inspect.isfunction):
+        if function.__module__ == players_module.__name__:
+            h.update(inspect.getsource(function).encode())
+    for name in sorted(set(lineup)):
+        for cls in getattr(players_module, name).__mro__[:-1]:
+            h.update(inspect.getsource(cls).encode())
+    return h.hexdigest()[:16]
+
+
+class ResultStore:
+    # Game results in a SQLite file. Results (from simulate with record set, so with "eliminations",
+    # "history" and its "nations", plus "lineup" and "version") are buffered and written batch_size at a time in one transaction; a game that is
+    # already stored under the same lineup, seed and version is skipped. Only one process should
+    # write, e.g. the tournament's, collecting the results of its workers.
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def add(self, result):
+        self.pending.append(dict(result))  # a copy, so the caller may drop the bulky fields
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            for r in self.pending:
+                lineup = ",".join(r["lineup"])
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO games "
+                    "(lineup, version, seed, players, winner, winner_class, plies, rounds, seconds) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        lineup, r["version"], r["seed"], json.dumps(r["players"]), r["winner"],
+                        r["players"][r["winner"]], r["plies"], r["rounds"], r["seconds"],
+                    ),
+                )
+                if cursor.rowcount == 0:
+                    continue
+                game_id = cursor.lastrowid
+                self.connection.executemany(
+                    "INSERT INTO eliminations VALUES (?, ?, ?, ?)",
+                    [(game_id, i, nation, ply) for i, (nation, ply) in enumerate(r.get("eliminations", []))],
+                )
+                nations = r.get("nations", [])
+                self.connection.executemany(
+                    "INSERT INTO rounds VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (game_id, round_num, nation, territories[k], troops[k])
+                        for round_num, territories, troops in r.get("history", [])
+                        for k, nation in enumerate(nations)
+                    ],
+                )
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def games(self, lineup=None, version=None):
+        # Stored games as dicts, optionally only those of one lineup and/or version
+        query, params = "SELECT * FROM games", []
+        conditions = []
+        if lineup is not None:
+            conditions.append("lineup = ?")
+            params.append(",".join(lineup))
+        if version is not None:
+            conditions.append("version = ?")
+            params.append(version)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        cursor = self.connection.execute(query + " ORDER BY id", params)
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def eliminations(self, game_id):
+        # [(nation, ply)] in the order the nations were eliminated
+        return self.connection.execute(
+            "SELECT nation, ply FROM eliminations WHERE game_id = ? ORDER BY position", (game_id,)
+        ).fetchall()
+
+    def history(self, game_id):
+        # {nation: [(round, territories, troops)]}
+        history = {}
+        for round_num, nation, territories, troops in self.connection.execute(
+            "SELECT round, nation, territories, troops FROM rounds WHERE game_id = ? ORDER BY round", (game_id,)
+        ):
+            history.setdefault(nation, []).append((round_num, territories, troops))
+        return history
+
+    def summary(self):
+        # (lineup, version, winner_class, games won, mean plies) for every stored lineup and version
+        return self.connection.execute(
+            "SELECT lineup, version, winner_class, COUNT(*), AVG(plies) FROM games "
+            "GROUP BY lineup, version, winner_class ORDER BY lineup, version, COUNT(*) DESC"
+        ).fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize the games in a results store.")
+    parser.add_argument("path", nargs="?", default="cache/results.db")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    store = ResultStore(args.path)
+    for lineup, version, winner_class, wins, mean_plies in store.summary():
+        logging.info(f"{lineup} @ {version}: {winner_class} won {wins} games, {mean_plies:.0f} plies/game")
+    store.close()
@@ -0,0 +1,162 @@
+import os
+import json
+import math
+import random
+import logging
+import argparse
+import itertools
+
+from results_store import ResultStore, lineup_version
+from tournament import play_games, make_players
+
+NATIONS = ["A", "B", "C", "D"]
+
+
+def rotations(lineup):
+    # Every distinct assignment of the lineup to the seats, so each class plays each seat (and turn
+    # position) equally often
+    return sorted(set(itertools.permutations(lineup)))
+
+
+def matchups(class_names, size=2, seats=len(NATIONS)):
+    # All combinations of size classes, each filling the seats in turn: a pair plays 2 against 2
+    for combination in itertools.combinations(class_names, size):
+        yield tuple(combination[i % size] for i in range(seats))
+
+
+def schedule(class_names, size=2, repeats=1, seed=0):
+    # (lineup, seed) jobs for every seat rotation of every matchup. All rotations of a matchup share
+    # their seeds, so they are played on the same dice, and seeds don't depend on the other classes.
+    jobs = []
+    for matchup in matchups(class_names, size):
+        for repeat in range(repeats):
+            game_seed = random.Random(f"{seed}/{'-'.join(sorted(matchup))}/{repeat}").getrandbits(32)
+            jobs.extend((lineup, game_seed) for lineup in rotations(matchup))
+    return jobs
+
+
+class ResultCache:
+    # Finished games as JSON lines, keyed by lineup, seed and lineup version
+    def __init__(self, path):
+        self.path = path
+        self.results = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    result = json.loads(line)
+                    self.results[self.key(result["lineup"], result["seed"], result["version"])] = result
+
+    @staticmethod
+    def key(lineup, seed, version):
+        return tuple(lineup), seed, version
+
+    def get(self, lineup, seed, version):
+        return self.results.get(self.key(lineup, seed, version))
+
+    def add(self, result):
+        self.results[self.key(result["lineup"], result["seed"], result["version"])] = result
+        with open(self.path, "a") as f:
+            f.write(json.dumps(result) + "\n")
+
+
+def run_schedule(jobs, workers=None, cache=None, store=None):
+    # Plays the jobs that are not in the cache in parallel; returns the results of all jobs. The
+    # games played are also written to the results store, if given.
+    versions = {lineup: lineup_version(lineup) for lineup, _ in jobs}
+    results, todo = [], []
+    for lineup, seed in jobs:
+        cached = cache.get(lineup, seed, versions[lineup]) if cache is not None else None
+        if cached is not None:
+            results.append(cached)
+        else:
+            todo.append((lineup, seed))
+    logging.info(f"{len(jobs)} games scheduled, {len(results)} cached, {len(todo)} to play")
+
+    games = play_games(
+        ((seed, make_players(lineup, NATIONS)) for lineup, seed in todo), workers, record=store is not None
+    )
+    for n, result in enumerate(games):
+        lineup = todo[result["game"]][0]
+        result["lineup"] = list(lineup)
+        result["version"] = versions[lineup]
+        result["winner_class"] = result["players"][result["winner"]]
+        del result["game"]
+        if store is not None:
+            store.add(result)
+            del result["eliminations"], result["history"], result["nations"]
+        results.append(result)
+        if cache is not None:
+            cache.add(result)
+        if (n + 1) % 50 == 0:
+            logging.info(f"{n + 1}/{len(todo)} games played")
+    return results
+
+
+def pairwise_wins(results):
+    # wins[a][b]: games won by class a in which class b also played
+    wins = {}
+    for r in results:
+        winner = r["winner_class"]
+        for other in set(r["lineup"]) - {winner}:
+            wins.setdefault(winner, {}).setdefault(other, 0)
+            wins[winner][other] += 1
+    return wins
+
+
+def matchup_matrix(results, class_names):
+    # Share of the games between a and b (won by either of them) that a won
+    wins = pairwise_wins(results)
+    matrix = {}
+    for a in class_names:
+        for b in class_names:
+            won, lost = wins.get(a, {}).get(b, 0), wins.get(b, {}).get(a, 0)
+            matrix[a, b] = won / (won + lost) if a != b and won + lost else None
+    return matrix
+
+
+def elo_ratings(results, class_names, iterations=1000):
+    # Bradley-Terry strengths fitted to the pairwise wins (with half a win each way as a prior, so
+    # unbeaten classes stay finite), on the Elo scale around 1500
+    wins = pairwise_wins(results)
+    w = {(a, b): wins.get(a, {}).get(b, 0) + 0.5 for a in class_names for b in class_names if a != b}
+    strength = {c: 1.0 for c in class_names}
+    for _ in range(iterations):
+        updated = {}
+        for a in class_names:
+            total_wins = sum(w[a, b] for b in class_names if b != a)
+            denominator = sum((w[a, b] + w[b, a]) / (strength[a] + strength[b]) for b in class_names if b != a)
+            updated[a] = total_wins / denominator
+        mean_log = sum(math.log(s) for s in updated.values()) / len(updated)
+        strength = {c: s / math.exp(mean_log) for c, s in updated.items()}
+    return {c: 1500 + 400 * math.log10(strength[c]) for c in class_names}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play every matchup of the given players in all seat rotations.")
+    parser.add_argument("players", nargs="*", default=["Player2", "Player3", "Player4", "Player6"])
+    parser.add_argument("--size", type=int, default=2, help="classes per matchup, 2 for pairwise")
+    parser.add_argument("--repeats", type=int, default=1, help="seeds per matchup, each played in every rotation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--cache", default="cache/results.jsonl")
+    parser.add_argument("--store", help="also write the games played to this SQLite results store")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    os.makedirs(os.path.dirname(args.cache) or ".", exist_ok=True)
+    jobs = schedule(args.players, args.size, args.repeats, args.seed)
+    if args.store:
+        os.makedirs(os.path.dirname(args.store) or ".", exist_ok=True)
+    store = ResultStore(args.store) if args.store else None
+    results = run_schedule(jobs, args.workers, ResultCache(args.cache), store)
+    if store is not None:
+        store.close()
+
+    matrix = matchup_matrix(results, args.players)
+    width = max(len(p) for p in args.players) + 2
+    logging.info("".rjust(width) + "".join(p.rjust(width) for p in args.players))
+    for a in args.players:
+        cells = ["-" if matrix[a, b] is None else f"{matrix[a, b]:.2f}" for b in args.players]
+        logging.info(a.rjust(width) + "".join(c.rjust(width) for c in cells))
+    for name, rating in sorted(elo_ratings(results, args.players).items(), key=lambda x: -x[1]):
+        logging.info(f"{name}: {rating:.0f}")
@@ -0,0 +1,36 @@
+import math
+
+
+def wilson_interval(wins, games, z=1.96):
+    # Wilson score interval for a win rate; well behaved for small samples and rates near 0 or 1
+    if games == 0:
+        return 0.0, 1.0
+    p = wins / games
+    denominator = 1 + z * z / games
+    center = (p + z * z / (2 * games)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / games + z * z / (4 * games * games)) / denominator
+    return max(center - half_width, 0.0), min(center + half_width, 1.0)
+
+
+class SequentialTest:
+    # Wald's sequential probability ratio test of whether player a beats player b, on the games
+    # that one of the two wins: H0 "a wins such a game with probability 0.5 - delta" against H1
+    # "with probability 0.5 + delta", with error rates alpha and beta. decision is a or b once the
+    # log likelihood ratio leaves the (lower, upper) bounds, None before.
+    def __init__(self, a, b, delta=0.05, alpha=0.05, beta=0.05):
+        self.a, self.b = a, b
+        self.win_llr = math.log((0.5 + delta) / (0.5 - delta))
+        self.lower = math.log(beta / (1 - alpha))
+        self.upper = math.log((1 - beta) / alpha)
+        self.llr = 0.0
+        self.decision = None
+
+    def add(self, winner):
+        if self.decision is not None or winner not in (self.a, self.b):
+            return self.decision
+        self.llr += self.win_llr if winner == self.a else -self.win_llr
+        if self.llr >= self.upper:
+            self.decision = self.a
+        elif self.llr <= self.lower:
+            self.decision = self.b
+        return self.decision
@@ -0,0 +1,215 @@
+import os
+import time
+import random
+import logging
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import players as players_module
+from profiling import Profiler
+from results_store import ResultStore, lineup_version
+from stats import wilson_interval, SequentialTest
+
+_map_info = None
+
+
+def _init_worker():
+    # Import the simulator and load the map once per worker process; games never modify it
+    global _map_info
+    import main
+    logging.getLogger().setLevel(logging.INFO)
+    _map_info = main.map_info
+
+
+def _play_game(game_id, seed, players, profile=False, record=False, budgets=(None, None)):
+    # budgets is (turn_budget, node_budget), see main.Game
+    import main
+    turn_budget, node_budget = budgets
+    if profile:
+        profiler = Profiler()
+        with profiler.attach_classes(main.Game, [type(p) for p in players]):
+            result = main.simulate(
+                players, seed, _map_info, record=record, turn_budget=turn_budget, node_budget=node_budget
+            )
+        result["profile"] = profiler.rows()
+    else:
+        result = main.simulate(players, seed, _map_info, record=record, turn_budget=turn_budget, node_budget=node_budget)
+    result["game"] = game_id
+    return result
+
+
+def game_seeds(seed, num_games):
+    rng = random.Random(seed)
+    return [rng.getrandbits(32) for _ in range(num_games)]
+
+
+def play_games(jobs, workers=None, profile=False, record=False, budgets=(None, None)):
+    # Plays (seed, players) jobs in parallel and yields one result per game, in order of
+    # completion, with "game" set to the job's index. Jobs are read lazily and only a couple of
+    # games per worker are queued at a time, so closing the generator early stops without a backlog.
+    workers = workers or os.cpu_count()
+    games = enumerate(jobs)
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    try:
+        pending = {
+            executor.submit(_play_game, i, game_seed, players, profile, record, budgets)
+            for i, (game_seed, players) in itertools.islice(games, 2 * workers)
+        }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for i, (game_seed, players) in itertools.islice(games, 1):
+                    pending.add(executor.submit(_play_game, i, game_seed, players, profile, record, budgets))
+                yield future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def in_game_order(results):
+    # Reorders results by game number, so stopping rules see the same sequence for any number of workers
+    waiting = {}
+    next_game = 0
+    for result in results:
+        waiting[result["game"]] = result
+        while next_game in waiting:
+            yield waiting.pop(next_game)
+            next_game += 1
+
+
+def summarize(results):
+    counts = {}
+    for r in results:
+        counts.setdefault(r["winner"], 0)
+        counts[r["winner"]] += 1
+    plies = [r["plies"] for r in results]
+    seconds = [r["seconds"] for r in results]
+    overruns = [o for r in results for o in r.get("overruns", [])]
+    return {
+        "games": len(results),
+        "counts": counts,
+        "mean_plies": sum(plies) / max(len(plies), 1),
+        "mean_seconds": sum(seconds) / max(len(seconds), 1),
+        "overruns": len(overruns),
+        "worst_turn_seconds": max([o[2] for o in overruns], default=None),
+    }
+
+
+def win_rates(results, nations):
+    # Win rate with its Wilson interval per nation
+    counts = summarize(results)["counts"]
+    return {
+        n: (counts.get(n, 0) / max(len(results), 1),) + wilson_interval(counts.get(n, 0), len(results))
+        for n in nations
+    }
+
+
+def run_tournament(
+    players, num_games, seed=0, workers=None, report_every=0, profile=False, ci_width=None, compare=None, delta=0.05,
+    store=None, turn_budget=None, node_budget=None,
+):
+    # Plays up to num_games games. With ci_width set, stops once every win rate's 95% interval is
+    # at most that wide; with compare = (a, b), stops once a sequential test decides whether
+    # nation a or b is the stronger one (by delta in head-to-head win rate, 5% error rates).
+    # With profile set, the summary has a "profiler" with the phase timings of all games. With a
+    # ResultStore, every game is written to it, with its elimination order and board per round.
+    # turn_budget (seconds per turn) and node_budget limit the players' decisions; the summary
+    # counts the turns that took longer than turn_budget anyway.
+    nations = [p.nation for p in players]
+    sequential = SequentialTest(*compare, delta=delta) if compare else None
+    results = []
+    profiler = Profiler() if profile else None
+    stopped = "games"
+    t0 = time.time()
+    lineup = [type(p).__name__ for p in players]
+    version = lineup_version(lineup) if store is not None else None
+    jobs = ((game_seed, players) for game_seed in game_seeds(seed, num_games))
+    games = in_game_order(play_games(
+        jobs, workers, profile, record=store is not None, budgets=(turn_budget, node_budget)
+    ))
+    for result in games:
+        if store is not None:
+            result["lineup"], result["version"] = lineup, version
+            store.add(result)
+            del result["eliminations"], result["history"], result["nations"]  # stored, no need to keep them around
+        results.append(result)
+        if profile:
+            profiler.merge(result["profile"])
+        if sequential is not None and sequential.add(result["winner"]) is not None:
+            stopped = "sequential test"
+        rates = win_rates(results, nations)
+        if ci_width is not None and all(high - low <= ci_width for _, low, high in rates.values()):
+            stopped = "ci width"
+        if report_every and len(results) % report_every == 0 or stopped != "games":
+            intervals = ", ".join(f"{n} {p:.3f} [{low:.3f}, {high:.3f}]" for n, (p, low, high) in rates.items())
+            llr = f", llr {sequential.llr:+.2f}" if sequential is not None else ""
+            logging.info(
+                f"{len(results)}/{num_games} games, {intervals}{llr}, {len(results) / (time.time() - t0):.1f} games/s"
+            )
+        if stopped != "games":
+            break
+    games.close()
+    if store is not None:
+        store.flush()
+    summary = summarize(results)
+    summary["wall_seconds"] = time.time() - t0
+    summary["win_rates"] = win_rates(results, nations)
+    summary["stopped"] = stopped
+    if sequential is not None:
+        summary["stronger"] = sequential.decision
+    if profile:
+        summary["profiler"] = profiler
+    return summary, results
+
+
+def make_players(class_names, nations):
+    return [getattr(players_module, name)(nation) for name, nation in zip(class_names, nations)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play many games in parallel and count the winners.")
+    parser.add_argument("players", nargs="*", default=["Player6", "Player2", "Player2", "Player2"])
+    parser.add_argument("--games", type=int, default=100, help="number of games, or the maximum with a stopping rule")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--report-every", type=int, default=10)
+    parser.add_argument("--profile", help="time the game phases and write them to this .json or .csv file")
+    parser.add_argument("--ci-width", type=float, help="stop once every win rate's 95%% interval is this narrow")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("A", "B"), help="stop once a sequential test finds the stronger of two nations"
+    )
+    parser.add_argument(
+        "--delta", type=float, default=0.05, help="head-to-head win rate difference the test should detect"
+    )
+    parser.add_argument("--store", help="write every game to this SQLite results store, e.g. cache/results.db")
+    parser.add_argument("--turn-budget", type=float, help="seconds each turn's decision may take")
+    parser.add_argument("--node-budget", type=int, help="attack paths each turn's search may expand")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(message)s", level=logging.INFO)
+    lineup = make_players(args.players, ["A", "B", "C", "D"])
+    if args.store:
+        os.makedirs(os.path.dirname(args.store) or ".", exist_ok=True)
+    store = ResultStore(args.store) if args.store else None
+    summary, _ = run_tournament(
+        lineup, args.games, args.seed, args.workers, args.report_every, profile=args.profile is not None,
+        ci_width=args.ci_width, compare=args.compare, delta=args.delta, store=store,
+        turn_budget=args.turn_budget, node_budget=args.node_budget,
+    )
+    if store is not None:
+        store.close()
+    logging.info(f"Results: {sorted(list(summary['counts'].items()), key=lambda x: -x[1])}".replace("'", ""))
+    logging.info(
+        f"{summary['games']} games, {summary['mean_plies']:.0f} plies/game, "
+        f"{summary['mean_seconds']*1000:.0f} ms/game, {summary['wall_seconds']:.1f} s wall"
+    )
+    if args.turn_budget is not None:
+        worst = f", the worst took {summary['worst_turn_seconds']*1000:.0f} ms" if summary["overruns"] else ""
+        logging.info(f"{summary['overruns']} turns over the {args.turn_budget*1000:.0f} ms budget{worst}")
+    if summary["stopped"] != "games":
+        logging.info(f"Stopped early on the {summary['stopped']}")
+    if args.compare:
+        logging.info(f"Stronger: {summary['stronger'] or 'undecided'}")
+    if args.profile:
+        summary["profiler"].export(args.profile)
+        logging.info(summary["profiler"].report())